@@ -0,0 +1,13 @@
+from goldenPensAPI.buffers import WriteBuffer
+from .models import User
+
+
+class LoginBuffer(WriteBuffer):
+    """last_login stamps, only the latest of each user, written with one UPDATE per batch."""
+    interval = 'LAST_LOGIN_FLUSH_INTERVAL'
+
+    def write(self, pending):
+        User.objects.bulk_update([User(pk=pk, last_login=stamp) for pk, stamp in pending.items()], ['last_login'])
+
+
+login_buffer = LoginBuffer()
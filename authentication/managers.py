@@ -1,4 +1,21 @@
 from django.contrib.auth.base_user import BaseUserManager
+from django.contrib.postgres.search import TrigramSimilarity
+from django.db import models
+from django.db.models import Count, Value, OuterRef, Subquery, Exists
+from django.db.models.functions import Greatest, Concat, Coalesce
+from django.apps import apps
+
+
+def followers_total(author):
+    # Counts the followers of the author pointed at by the outer query without multiplying its rows
+    through = apps.get_model('authentication', 'Author').followers.through
+    return Coalesce(Subquery(through.objects.filter(author=OuterRef(author)).order_by().values('author')
+                             .annotate(total=Count('*')).values('total')), 0)
+
+
+def in_followers(author, user_pk):
+    through = apps.get_model('authentication', 'Author').followers.through
+    return Exists(through.objects.filter(author=OuterRef(author), user__pk=user_pk))
 
 
 class UserManager(BaseUserManager):
@@ -7,7 +24,7 @@ class UserManager(BaseUserManager):
         user = self.model(email=email, **extras)
         if password is not None:
             user.set_password(password)
-            user.save()
+        user.save()
         return user
 
     def create_user(self, email, password=None, **extras):
@@ -18,3 +35,21 @@ class UserManager(BaseUserManager):
         extras.setdefault('is_superuser', True)
         extras.setdefault('email_verified', True)
         return self._create_user(email, password, **extras)
+
+
+class AuthorManager(models.Manager):
+
+    def directory(self, search=None, user_pk=None):
+        # Authors with at least one story, each count and the viewer's follow state resolved in the same query
+        stories = apps.get_model('stories', 'Story').objects.filter(author=OuterRef('pk'))
+        queryset = self.select_related('user').filter(Exists(stories))\
+            .annotate(followers_total=followers_total('pk'))
+        if user_pk is not None:
+            queryset = queryset.annotate(in_followers=in_followers('pk', user_pk))
+        if search is not None:
+            return queryset.annotate(fullname=Concat('user__first_name', Value(' '), 'user__last_name'),
+                                     similarity=Greatest(
+                                         TrigramSimilarity('fullname', search),
+                                         TrigramSimilarity('nickname', search)
+                                     )).filter(similarity__gte=0.1).order_by('-similarity', 'pk')
+        return queryset.order_by('-followers_total', 'pk')
@@ -0,0 +1,18 @@
+# Generated by Django 3.0.7 on 2026-10-17 20:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_auto_20210117_1632'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='tokens_revoked',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
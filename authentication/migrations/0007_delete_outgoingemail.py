@@ -0,0 +1,30 @@
+# Generated by Django 3.0.7 on 2026-10-17 21:40
+
+from django.db import migrations
+
+
+def queue_outbox_as_jobs(apps, schema_editor):
+    # Emails still in the outbox, dead letters included, carry over to the job queue with their attempts and error.
+    # They keep the outbox's five attempts rather than reading JOBS_MAX_ATTEMPTS, which may differ when this runs
+    OutgoingEmail = apps.get_model('authentication', 'OutgoingEmail')
+    Job = apps.get_model('jobs', 'Job')
+    Job.objects.bulk_create([
+        Job(name='authentication.models.send_email', args=[email.subject, email.body, email.to, email.template,
+                                                           email.context],
+            run_after=email.send_after, attempts=email.attempts, max_attempts=5, error=email.error)
+        for email in OutgoingEmail.objects.order_by('pk')])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('jobs', '0001_initial'),
+        ('authentication', '0006_image_renditions'),
+    ]
+
+    operations = [
+        migrations.RunPython(queue_outbox_as_jobs, migrations.RunPython.noop),
+        migrations.DeleteModel(
+            name='OutgoingEmail',
+        ),
+    ]
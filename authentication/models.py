@@ -1,15 +1,22 @@
 from django.db import models
 from django.contrib.auth.models import AbstractBaseUser, PermissionsMixin
-from .managers import UserManager
+from .managers import UserManager, AuthorManager
 from django.dispatch import receiver
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete
 from .signals import initialize_user
+from .tokens import issue_access_token, revocations
+from jobs.queue import job
+from stories.caching import bump
+from goldenPensAPI.images import store_renditions
 import jwt
 from django.conf import settings
 from datetime import datetime, timedelta
 import pytz
 from django.utils import timezone
 from django.contrib.postgres.fields import JSONField
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import render_to_string
+from contextlib import contextmanager
 
 
 class User(AbstractBaseUser, PermissionsMixin):
@@ -19,8 +26,10 @@ class User(AbstractBaseUser, PermissionsMixin):
     first_name = models.CharField(max_length=50)
     last_name = models.CharField(max_length=50)
     picture = models.ImageField(upload_to='Profiles', null=True, blank=True)
+    picture_renditions = JSONField(default=dict, blank=True, editable=False)
     social_picture = models.CharField(max_length=500, null=True, blank=True)
     cover = models.ImageField(upload_to='Covers', null=True, blank=True)
+    cover_renditions = JSONField(default=dict, blank=True, editable=False)
     is_staff = models.BooleanField(default=False)
     is_active = models.BooleanField(default=True)
     email_verified = models.BooleanField(default=False)
@@ -28,6 +37,7 @@ class User(AbstractBaseUser, PermissionsMixin):
     joined = models.DateField(auto_now_add=True, editable=False)
     last_password_reset = models.DateTimeField(null=True, blank=True)
     current_reset_token = models.CharField(max_length=500, null=True, blank=True)
+    tokens_revoked = models.DateTimeField(null=True, blank=True)
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = []
@@ -48,6 +58,9 @@ class User(AbstractBaseUser, PermissionsMixin):
         return jwt.encode({'email': self.email, 'exp': datetime.now() + timedelta(days=3)},
                           settings.SECRET_KEY, algorithm='HS256').decode()
 
+    def get_access_token(self):
+        return issue_access_token(self.pk)
+
     def with_provider(self):
         return self.social_id is not None
 
@@ -72,6 +85,45 @@ def init_callback(sender, instance, created, **kwargs):
         initialize_user(instance)
 
 
+@job
+def delete_account(user_pk):
+    # Cascades through the user's stories, chapters, replies and follows
+    User.objects.filter(pk=user_pk).delete()
+
+
+@contextmanager
+def mail_connection():
+    # The emails the worker sends together share one SMTP connection rather than opening one each
+    with get_connection() as connection:
+        yield {'connection': connection}
+
+
+@job(batch=mail_connection)
+def send_email(subject, body, to, template=None, context=None, connection=None):
+    # Queued in the request's transaction, so it is only sent if that commits, and retried while the server fails
+    message = EmailMultiAlternatives(subject, body, settings.DEFAULT_FROM_EMAIL, to, connection=connection)
+    if template is not None:
+        message.attach_alternative(render_to_string(template, context or {}), 'text/html')
+    message.send()
+
+
+@job
+def build_image_renditions(user_pk, field):
+    if store_renditions(User, user_pk, field) is not None:
+        bump(f'author:{user_pk}')
+
+
+@receiver(post_save, sender=User)
+def revoke_suspended(sender, instance, **kwargs):
+    if not instance.is_active:
+        revocations.revoke(instance.pk)
+
+
+@receiver(post_delete, sender=User)
+def revoke_deleted(sender, instance, **kwargs):
+    revocations.revoke(instance.pk)
+
+
 def get_default_social():
     return {'fb': None, 'insta': None, 'twitter': None}
 
@@ -82,6 +134,8 @@ class Author(models.Model):
     followers = models.ManyToManyField(User, related_name='followers', blank=True)
     social = JSONField(default=get_default_social)
 
+    objects = AuthorManager()
+
     def __str__(self):
         return self.user.email
 
@@ -89,4 +143,6 @@ class Author(models.Model):
         return self.stories.count()
 
     def followers_count(self):
+        if hasattr(self, 'followers_total'):
+            return self.followers_total
         return self.followers.count()
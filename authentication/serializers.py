@@ -1,5 +1,6 @@
 from .models import User, Author
 from rest_framework.serializers import ModelSerializer, ReadOnlyField
+from goldenPensAPI.images import RenditionsField
 
 
 class AuthorSerializer(ModelSerializer):
@@ -14,22 +15,26 @@ class AuthorSerializer(ModelSerializer):
 class UserSerializer(ModelSerializer):
 
     get_jwt = ReadOnlyField()
+    get_access_token = ReadOnlyField()
     token = ReadOnlyField()
     with_provider = ReadOnlyField()
     author = AuthorSerializer(required=False)
+    picture_renditions = RenditionsField('picture')
+    cover_renditions = RenditionsField('cover')
 
     class Meta:
         model = User
-        fields = ['first_name', 'last_name', 'email', 'picture', 'social_picture', 'cover', 'pk', 'get_jwt',
-                  'token', 'with_provider', 'author']
+        fields = ['first_name', 'last_name', 'email', 'picture', 'picture_renditions', 'social_picture', 'cover',
+                  'cover_renditions', 'pk', 'get_jwt', 'get_access_token', 'token', 'with_provider', 'author']
 
 
 class UserSimpleSerializer(ModelSerializer):
 
     fullname = ReadOnlyField()
+    picture_renditions = RenditionsField('picture')
 
     class Meta:
-        fields = ['pk', 'social_picture', 'picture', 'fullname']
+        fields = ['pk', 'social_picture', 'picture', 'picture_renditions', 'fullname']
         model = User
 
 
@@ -57,7 +62,10 @@ class UserProfileSerializer(ModelSerializer):
 
     author = AuthorProfileSerializer()
     fullname = ReadOnlyField()
+    picture_renditions = RenditionsField('picture')
+    cover_renditions = RenditionsField('cover')
 
     class Meta:
-        fields = ['pk', 'social_picture', 'picture', 'fullname', 'cover', 'author']
+        fields = ['pk', 'social_picture', 'picture', 'picture_renditions', 'fullname', 'cover', 'cover_renditions',
+                  'author']
         model = User
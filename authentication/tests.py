@@ -1,12 +1,23 @@
-from rest_framework.test import APITestCase
+from rest_framework.test import APITestCase, APIRequestFactory
 from django.shortcuts import reverse
 from django.core import mail
-from .models import User
-from .utils import generate_test_token
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.backends import locmem
+from .models import User, send_email
+from .utils import generate_test_token, record_login
+from .buffers import login_buffer
+from jobs.queue import run_pending
+from jobs.models import Job
+from stories.models import Story
+from .tokens import AccessTokenAuthentication, revocations
+from django.conf import settings
+from django.test import override_settings
 from datetime import datetime, timedelta
 from django.utils import timezone
-from stories.utils import create_test_story
+from stories.utils import create_test_story, seed_fan_out, QueryBudgetMixin
 from django.core.files.uploadedfile import SimpleUploadedFile
+from smtplib import SMTPException
+import jwt
 
 classic_register_data = {
     'first_name': 'John',
@@ -43,6 +54,7 @@ class AuthSignup(APITestCase):
         user = users[0]
         self.assertEqual(user.email, 'John@example.com')
         self.assertFalse(user.email_verified)
+        run_pending()
         self.assertEqual(len(mail.outbox), 1)
 
     def test_email_unique_constraint(self):
@@ -133,6 +145,7 @@ class AuthVerification(APITestCase):
                                     {'email': user.email}, format='json')
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response.data['success'])
+        run_pending()
         self.assertEqual(len(mail.outbox), 1)
 
     def test_sends_reset_request_for_verified_email(self):
@@ -143,6 +156,7 @@ class AuthVerification(APITestCase):
                                     {'email': user.email}, format='json')
         self.assertEqual(response.status_code, 200)
         self.assertTrue(response.data['success'])
+        run_pending()
         self.assertEqual(len(mail.outbox), 1)
 
     def test_rejects_sending_resets_for_unverified_emails(self):
@@ -151,6 +165,7 @@ class AuthVerification(APITestCase):
                                     {'email': user.email}, format='json')
         self.assertFalse(user.email_verified)
         self.assertEqual(response.status_code, 400)
+        run_pending()
         self.assertEqual(len(mail.outbox), 0)
 
     def test_rejects_sending_resets_for_social_users(self):
@@ -162,12 +177,14 @@ class AuthVerification(APITestCase):
         user = User.objects.create_user(**register_data)
         response = self.client.post(reverse('authentication:send_reset_request'), {'email': user.email}, format='json')
         self.assertEqual(response.status_code, 400)
+        run_pending()
         self.assertEqual(len(mail.outbox), 0)
 
     def test_rejects_sending_resets_for_not_existing_emails(self):
         response = self.client.post(reverse('authentication:send_reset_request'),
                                     {'email': 'John@example.com'}, format='json')
         self.assertEqual(response.status_code, 400)
+        run_pending()
         self.assertEqual(len(mail.outbox), 0)
 
     def test_rejects_sending_more_resets_than_limit(self):
@@ -179,6 +196,7 @@ class AuthVerification(APITestCase):
         response = self.client.post(reverse('authentication:send_reset_request'),
                                     {'email': 'John@example.com'}, format='json')
         self.assertEqual(response.status_code, 429)
+        run_pending()
         self.assertEqual(len(mail.outbox), 0)
 
     def test_resets_password_for_valid_tokens(self):
@@ -324,6 +342,16 @@ class AuthUpdate(APITestCase):
         self.assertEqual(user.first_name, 'Joe')
         self.assertEqual(user.last_name, 'Nash')
 
+    def test_reindexes_stories_only_when_renamed(self):
+        user = User.objects.create_user(**classic_register_data)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        update_data = {'first_name': user.first_name, 'last_name': user.last_name, 'email': user.email}
+        self.client.post(reverse('authentication:update_user', args=[user.pk]), update_data, format='json')
+        self.assertFalse(Job.objects.filter(name='stories.models.index_author_stories').exists())
+        update_data = {**update_data, 'last_name': 'Nash'}
+        self.client.post(reverse('authentication:update_user', args=[user.pk]), update_data, format='json')
+        self.assertEqual(Job.objects.filter(name='stories.models.index_author_stories').count(), 1)
+
     def test_sends_verification_email_before_updating_email(self):
         user = User.objects.create_user(**classic_register_data)
         self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
@@ -334,6 +362,7 @@ class AuthUpdate(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(user.email, 'John@example.com')
         self.assertEqual(user.temp_email, 'New@example.com')
+        run_pending()
         self.assertEqual(len(mail.outbox), 1)
 
     def test_checks_if_new_email_exists(self):
@@ -348,6 +377,7 @@ class AuthUpdate(APITestCase):
         self.assertEqual(response.status_code, 400)
         self.assertEqual(user.email, 'John@example.com')
         self.assertIsNone(user.temp_email)
+        run_pending()
         self.assertEqual(len(mail.outbox), 0)
 
     def test_updates_author_information(self):
@@ -403,6 +433,15 @@ class AuthFetch(APITestCase):
         self.assertEqual(results[0]['user']['pk'], story2.author.user.pk)
         self.assertEqual(results[1]['user']['pk'], story.author.user.pk)
 
+    def test_counts_only_listed_authors(self):
+        story = create_test_story()
+        User.objects.create_user(**{**classic_register_data, 'email': 'reader@email.com'})
+        response = self.client.get(f"{reverse('authentication:authors')}?user={story.author.pk}")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['total'], 1)
+        self.assertEqual(response.data['results'][0]['followers'], 0)
+        self.assertFalse(response.data['results'][0]['inFollowers'])
+
     def test_filters_authors_with_trigram_correctly(self):
         story = create_test_story(email='my@email.com')
         story2 = create_test_story()
@@ -464,3 +503,327 @@ class AuthDelete(APITestCase):
         response = self.client.post(reverse('authentication:delete', args=[user.pk]), data, format='json')
         self.assertEqual(response.status_code, 401)
         self.assertEqual(User.objects.count(), 1)
+
+
+class AccessTokens(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(**classic_register_data)
+        revocations.load()
+
+    def bearer(self, token=None):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {token or self.user.get_access_token()}')
+
+    def change_password(self):
+        data = {'password': classic_register_data['password'], 'currentPassword': classic_register_data['password']}
+        return self.client.post(reverse('authentication:update_security', args=[self.user.pk]), data, format='json')
+
+    def test_authenticates_without_query(self):
+        request = APIRequestFactory().post('/', HTTP_AUTHORIZATION=f'Bearer {self.user.get_access_token()}')
+        with self.assertNumQueries(0):
+            user, payload = AccessTokenAuthentication().authenticate(request)
+            self.assertEqual(user.pk, self.user.pk)
+            self.assertTrue(user.is_authenticated)
+        self.assertEqual(user.email, self.user.email)
+
+    def test_authorizes_with_access_token(self):
+        self.bearer()
+        self.assertEqual(self.change_password().status_code, 200)
+
+    def test_rejects_long_lived_jwt(self):
+        self.bearer(self.user.get_jwt())
+        self.assertEqual(self.change_password().status_code, 401)
+
+    def test_rejects_expired_access_token(self):
+        self.bearer(jwt.encode({'pk': self.user.pk, 'type': 'access', 'iat': 0, 'exp': 1}, settings.SECRET_KEY,
+                               algorithm='HS256').decode())
+        self.assertEqual(self.change_password().status_code, 401)
+
+    def test_refreshes_with_drf_token(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.user.token()}')
+        response = self.client.post(reverse('authentication:access_token'))
+        self.assertEqual(response.status_code, 200)
+        self.bearer(response.data['access'])
+        self.assertEqual(self.change_password().status_code, 200)
+
+    def test_login_issues_access_token(self):
+        User.objects.filter(pk=self.user.pk).update(email_verified=True)
+        data = {'email': self.user.email, 'password': classic_register_data['password'], 'withProvider': False}
+        response = self.client.post(reverse('authentication:login_user'), data, format='json')
+        self.bearer(response.data['get_access_token'])
+        self.assertEqual(self.change_password().status_code, 200)
+
+    def test_logout_revokes_tokens(self):
+        token = self.user.token()
+        self.bearer()
+        self.assertEqual(self.client.post(reverse('authentication:logout')).status_code, 204)
+        self.assertEqual(self.change_password().status_code, 401)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.assertEqual(self.client.post(reverse('authentication:access_token')).status_code, 401)
+        # Tokens issued after logging out are valid again
+        self.bearer(User.objects.get(pk=self.user.pk).get_access_token())
+        self.assertEqual(self.change_password().status_code, 200)
+
+    def test_suspension_revokes_tokens(self):
+        self.bearer()
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.change_password().status_code, 401)
+
+    def test_reloads_revocations_from_database(self):
+        # Another process logging the user out is picked up on the next reload
+        self.bearer()
+        User.objects.filter(pk=self.user.pk).update(tokens_revoked=timezone.now())
+        self.assertEqual(self.change_password().status_code, 200)
+        revocations.loaded -= settings.ACCESS_TOKEN_REVOCATION_REFRESH + 1
+        self.assertEqual(self.change_password().status_code, 401)
+
+
+class LastLogin(APITestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user(**classic_register_data)
+
+    def test_skips_recent_login(self):
+        User.objects.filter(pk=self.user.pk).update(last_login=timezone.now())
+        user = User.objects.get(pk=self.user.pk)
+        with self.assertNumQueries(0):
+            self.assertFalse(record_login(user))
+
+    def test_updates_stale_login(self):
+        stale = timezone.now() - timedelta(seconds=settings.LAST_LOGIN_RESOLUTION + 1)
+        User.objects.filter(pk=self.user.pk).update(last_login=stale, first_name='Stale')
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Changed'
+        with self.assertNumQueries(1):
+            self.assertTrue(record_login(user))
+        stored = User.objects.get(pk=self.user.pk)
+        self.assertGreater(stored.last_login, stale)
+        # Only last_login is written
+        self.assertEqual(stored.first_name, 'Stale')
+
+    @override_settings(BUFFER_LAST_LOGIN=True, LAST_LOGIN_FLUSH_INTERVAL=3600)
+    def test_buffers_logins(self):
+        other = User.objects.create_user(**{**classic_register_data, 'email': 'other@example.com'})
+        with self.assertNumQueries(0):
+            record_login(self.user)
+            record_login(other)
+        self.assertEqual(len(login_buffer), 2)
+        self.assertFalse(User.objects.filter(last_login__isnull=False).exists())
+        with self.assertNumQueries(1):
+            self.assertEqual(login_buffer.flush(), 2)
+        self.assertEqual(User.objects.filter(last_login__isnull=False).count(), 2)
+
+
+class FailingBackend(BaseEmailBackend):
+
+    def send_messages(self, email_messages):
+        raise SMTPException('Service unavailable')
+
+
+class CountingBackend(locmem.EmailBackend):
+    opened = 0
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        CountingBackend.opened += 1
+
+
+class QueuedEmails(APITestCase):
+
+    def test_sends_queued_emails_once_jobs_run(self):
+        data = {**classic_register_data, 'withProvider': False}
+        self.client.post(reverse('authentication:register_new_user'), data, format='json')
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(Job.objects.get().name, 'authentication.models.send_email')
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertEqual(mail.outbox[0].to, ['John@example.com'])
+        self.assertEqual(mail.outbox[0].from_email, settings.DEFAULT_FROM_EMAIL)
+        self.assertIn('/verify/', mail.outbox[0].alternatives[0][0])
+        self.assertFalse(Job.objects.exists())
+
+    @override_settings(EMAIL_BACKEND='authentication.tests.CountingBackend')
+    def test_sends_due_emails_over_one_connection(self):
+        CountingBackend.opened = 0
+        for to in ['a@example.com', 'b@example.com', 'c@example.com']:
+            send_email.delay('Subject', 'Body', [to])
+        self.assertEqual(run_pending(), (3, 0))
+        self.assertEqual([message.to for message in mail.outbox], [['a@example.com'], ['b@example.com'],
+                                                                    ['c@example.com']])
+        self.assertEqual(CountingBackend.opened, 1)
+
+    @override_settings(EMAIL_BACKEND='authentication.tests.FailingBackend')
+    def test_retries_failed_emails_later(self):
+        send_email.delay('Subject', 'Body', ['user@example.com'], 'email_verify.html', {'link': 'link'})
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 1))
+        job = Job.objects.get()
+        self.assertEqual(job.attempts, 1)
+        self.assertGreater(job.run_after, timezone.now())
+        self.assertIn('Service unavailable', job.error)
+
+
+class AccountDeletion(APITestCase):
+
+    def test_closes_account_and_deletes_it_in_background(self):
+        story = create_test_story()
+        run_pending()
+        user = story.author.user
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        data = {'password': classic_register_data['password']}
+        response = self.client.post(reverse('authentication:delete', args=[user.pk]), data, format='json')
+        self.assertEqual(response.status_code, 204)
+        self.assertFalse(User.objects.get(pk=user.pk).is_active)
+        response = self.client.post(reverse('authentication:delete', args=[user.pk]), data, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(run_pending(), (1, 0))
+        self.assertFalse(User.objects.filter(pk=user.pk).exists())
+        self.assertFalse(Story.objects.filter(pk=story.pk).exists())
+
+
+class QueryBudgetTest(QueryBudgetMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.story, readers = seed_fan_out()
+        User.objects.filter(pk__in=[reader.pk for reader in readers]).update(email_verified=True)
+        cls.user = User.objects.get(pk=readers[0].pk)
+
+    def setUp(self):
+        revocations.load()
+
+    def authenticate(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {self.user.get_access_token()}')
+
+    def test_register_budget(self):
+        data = {**classic_register_data, 'email': 'new@example.com', 'withProvider': False}
+        with self.assertQueryBudget(7):
+            response = self.client.post(reverse('authentication:register_new_user'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_provider_register_budget(self):
+        data = {**classic_register_data, 'email': 'social@example.com', 'social_id': '1234-1234',
+                'social_picture': 'http://pic_url/', 'password': None, 'withProvider': True}
+        with self.assertQueryBudget(5) as context:
+            response = self.client.post(reverse('authentication:register_new_user'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('UPDATE "authentication_user"')])
+
+    def test_authenticate_jwt_budget(self):
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:authenticate_jwt'), {'token': self.user.get_jwt()})
+        self.assertEqual(response.status_code, 200)
+
+    def test_repeat_authenticate_jwt_budget(self):
+        # A re-authentication soon after the last one doesn't write
+        User.objects.filter(pk=self.user.pk).update(last_login=timezone.now())
+        with self.assertQueryBudget(4):
+            response = self.client.post(reverse('authentication:authenticate_jwt'), {'token': self.user.get_jwt()})
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_budget(self):
+        data = {'email': self.user.email, 'password': classic_register_data['password'], 'withProvider': False}
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:login_user'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_provider_signup_budget(self):
+        data = {**classic_register_data, 'email': 'social@example.com', 'social_id': '1234-1234',
+                'social_picture': 'http://pic_url/', 'password': None, 'withProvider': True}
+        with self.assertQueryBudget(5) as context:
+            response = self.client.post(reverse('authentication:login_user'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        # The user row is written once, by create_user
+        self.assertFalse([query for query in context.captured_queries
+                          if query['sql'].startswith('UPDATE "authentication_user"')])
+
+    def test_verify_email_budget(self):
+        User.objects.filter(pk=self.user.pk).update(email_verified=False)
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:verify_email'), {'token': self.user.get_auth_jwt()},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_send_reset_request_budget(self):
+        with self.assertQueryBudget(6):
+            response = self.client.post(reverse('authentication:send_reset_request'), {'email': self.user.email},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_complete_reset_budget(self):
+        token = self.user.get_auth_jwt()
+        User.objects.filter(pk=self.user.pk).update(current_reset_token=token)
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:complete_reset'), {'token': token, 'password': 'pw'},
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_user_budget(self):
+        self.authenticate()
+        data = {'first_name': 'Joe', 'last_name': 'Nash', 'email': self.user.email}
+        with self.assertQueryBudget(3):
+            response = self.client.post(reverse('authentication:update_user', args=[self.user.pk]), data,
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_author_budget(self):
+        self.authenticate()
+        data = {'author': {'nickname': 'Max', 'social': {'fb': None, 'insta': None, 'twitter': None}}}
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:update_author', args=[self.user.pk]), data,
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_security_budget(self):
+        self.authenticate()
+        data = {'password': 'newPassword', 'currentPassword': classic_register_data['password']}
+        with self.assertQueryBudget(2):
+            response = self.client.post(reverse('authentication:update_security', args=[self.user.pk]), data,
+                                        format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_authors_budget(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(f"{reverse('authentication:authors')}?user={self.user.pk}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_authors_search_budget(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(f"{reverse('authentication:authors')}?user={self.user.pk}&search=John")
+        self.assertEqual(response.status_code, 200)
+
+    def test_profile_budget(self):
+        url = f"{reverse('authentication:profile', args=[self.story.author.pk])}?user={self.user.pk}"
+        with self.assertQueryBudget(5):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_media_budget(self):
+        self.authenticate()
+        with open('stories/testImage.png', 'rb') as image:
+            picture = SimpleUploadedFile('picture.png', image.read())
+        with self.assertQueryBudget(3):
+            response = self.client.post(reverse('authentication:update_media'), {'picture': picture,
+                                                                                 'user': self.user.pk})
+        self.assertEqual(response.status_code, 200)
+
+    def test_delete_budget(self):
+        self.authenticate()
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:delete', args=[self.user.pk]),
+                                        {'password': classic_register_data['password']}, format='json')
+        self.assertEqual(response.status_code, 204)
+
+    def test_access_token_budget(self):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.user.token()}')
+        with self.assertQueryBudget(1):
+            response = self.client.post(reverse('authentication:access_token'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.data), {'access', 'expiresIn'})
+
+    def test_logout_budget(self):
+        self.authenticate()
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('authentication:logout'))
+        self.assertEqual(response.status_code, 204)
@@ -0,0 +1,98 @@
+"""Short-lived access tokens, authenticated from their signature alone.
+
+An access token is an HS256 JWT issued for ACCESS_TOKEN_LIFETIME seconds and refreshed with the DRF token the client
+already holds. Logging out and suspension only have to outlive the access tokens already handed out, so each process
+keeps the users revoked within that window in memory and reloads them every ACCESS_TOKEN_REVOCATION_REFRESH seconds.
+"""
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+from rest_framework.authentication import BaseAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+from datetime import timedelta
+import threading
+import math
+import time
+import jwt
+
+
+def issue_access_token(user_pk):
+    issued = time.time()
+    return jwt.encode({'pk': user_pk, 'type': 'access', 'iat': issued, 'exp': issued + settings.ACCESS_TOKEN_LIFETIME},
+                      settings.SECRET_KEY, algorithm='HS256').decode()
+
+
+class RevocationList:
+    """Maps the pk of every user whose access tokens may still be revoked to the time they were revoked at."""
+
+    def __init__(self):
+        self.revoked = {}
+        self.loaded = None
+        self.lock = threading.Lock()
+
+    def load(self):
+        from .models import User
+
+        horizon = timezone.now() - timedelta(seconds=settings.ACCESS_TOKEN_LIFETIME)
+        users = User.objects.filter(Q(is_active=False) | Q(tokens_revoked__gt=horizon))
+        revoked = {}
+        for pk, active, revoked_at in users.values_list('pk', 'is_active', 'tokens_revoked'):
+            revoked[pk] = math.inf if not active else revoked_at.timestamp()
+        with self.lock:
+            self.revoked, self.loaded = revoked, time.monotonic()
+
+    def revoke(self, user_pk, revoked_at=math.inf):
+        # Takes effect at once in this process, the others pick it up on their next load
+        with self.lock:
+            self.revoked[user_pk] = max(revoked_at, self.revoked.get(user_pk, 0))
+
+    def is_revoked(self, user_pk, issued):
+        if self.loaded is None or time.monotonic() - self.loaded > settings.ACCESS_TOKEN_REVOCATION_REFRESH:
+            self.load()
+        return issued <= self.revoked.get(user_pk, -math.inf)
+
+
+revocations = RevocationList()
+
+
+class AccessTokenUser(SimpleLazyObject):
+    """The user a token was issued to, only loaded from the database once more than its pk is needed."""
+
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, pk):
+        from .models import User
+
+        super().__init__(lambda: User.objects.get(pk=pk))
+        self.__dict__['pk'] = pk
+
+    def __bool__(self):
+        # Permission checks test the user's truthiness first
+        return True
+
+
+class AccessTokenAuthentication(BaseAuthentication):
+    """Authenticates 'Authorization: Bearer <access token>' headers without a database query."""
+
+    keyword = 'Bearer'
+
+    def authenticate(self, request):
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) != 2:
+            raise AuthenticationFailed('Invalid token header.')
+
+        try:
+            payload = jwt.decode(auth[1], settings.SECRET_KEY, algorithms=['HS256'])
+        except jwt.InvalidTokenError:
+            raise AuthenticationFailed('Invalid or expired token.')
+        # The long lived tokens of User.get_jwt() carry a pk too, but only re-authenticate through auth_jwt
+        if payload.get('type') != 'access' or revocations.is_revoked(payload['pk'], payload['iat']):
+            raise AuthenticationFailed('Invalid or expired token.')
+        return AccessTokenUser(payload['pk']), payload
+
+    def authenticate_header(self, request):
+        return self.keyword
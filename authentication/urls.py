@@ -8,6 +8,8 @@ urlpatterns = [
     path('auth_jwt', views.authenticate_jwt, name='authenticate_jwt'),
     path('login', views.login_user, name='login_user'),
     path('verify_email', views.verify_email, name='verify_email'),
+    path('access_token', views.refresh_access_token, name='access_token'),
+    path('logout', views.logout_user, name='logout'),
     path('request_reset', views.send_reset_request, name='send_reset_request'),
     path('complete_reset', views.complete_reset, name='complete_reset'),
     path('update_user/<int:pk>', views.update_user, name='update_user'),
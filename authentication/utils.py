@@ -2,6 +2,9 @@ from .models import User
 from django.core.exceptions import ObjectDoesNotExist
 import jwt
 from django.conf import settings
+from django.utils import timezone
+from datetime import timedelta
+from .buffers import login_buffer
 from stories.models import Chapter, Story, Reply
 
 
@@ -16,34 +19,38 @@ def authenticate(email, password):
         return None
 
 
+def record_login(user):
+    # Logins within LAST_LOGIN_RESOLUTION seconds of the stored one are not worth a write
+    now = timezone.now()
+    if user.last_login is not None and now - user.last_login < timedelta(seconds=settings.LAST_LOGIN_RESOLUTION):
+        return False
+    user.last_login = now
+    if settings.BUFFER_LAST_LOGIN:
+        login_buffer.add(user.pk, now)
+    else:
+        User.objects.filter(pk=user.pk).update(last_login=now)
+    return True
+
+
 def generate_test_token(payload):
     return jwt.encode({**payload, 'exp': 1}, settings.SECRET_KEY, algorithm='HS256').decode()
 
 
 def validate_auth(request, pk, comp):
-    def get_story_user():
-        return Story.objects.get(pk=pk).author.user.token()
-
-    def get_chapter_user():
-        return Chapter.objects.get(pk=pk).story.author.user.token()
-
-    def get_user():
-        return User.objects.get(pk=pk).token()
-
-    def get_reply_user():
-        return Reply.objects.get(pk=pk).user.token()
+    # The authentication class already loaded the requesting user, ownership is a single EXISTS against it
+    user = request.user
+    if not user.is_authenticated:
+        return False
 
-    pk_factory = {
-        'story': get_story_user,
-        'chapter': get_chapter_user,
-        'user': get_user,
-        'reply': get_reply_user
+    owned_by = {
+        'story': lambda: Story.objects.filter(pk=pk, author__pk=user.pk).exists(),
+        'chapter': lambda: Chapter.objects.filter(pk=pk, story__author__pk=user.pk).exists(),
+        'user': lambda: str(pk) == str(user.pk),
+        'reply': lambda: Reply.objects.filter(pk=pk, user__pk=user.pk).exists()
     }
-    auth = request.headers['Authorization']
-    token = auth.split(' ')[1]
     try:
-        return token == pk_factory[comp]()
-    except ObjectDoesNotExist:
+        return owned_by[comp]()
+    except (ValueError, TypeError):
         return False
 
 
@@ -1,24 +1,23 @@
 from rest_framework.decorators import api_view, authentication_classes, permission_classes, throttle_classes
 from rest_framework.throttling import AnonRateThrottle
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from rest_framework import status
-from django.core.mail import send_mail
-from .models import User, Author
+from .models import User, Author, delete_account, build_image_renditions, send_email
+from stories.models import index_author_stories
+from stories.caching import cached_response
+from stories.state import followed_authors
 from .serializers import UserSerializer
-from django.template.loader import render_to_string
 from django.conf import settings
 from django.db.transaction import atomic
 import jwt
-from .utils import authenticate, NotVerifiedError, UsedToken, validate_auth
+from .utils import authenticate, NotVerifiedError, UsedToken, validate_auth, record_login
+from .tokens import revocations
 from django.core.exceptions import ObjectDoesNotExist
 from django.utils import timezone
-from smtplib import SMTPException
 from .serializers import AuthorSimpleSerializer, UserProfileSerializer
-from django.db.models import Count, Value
-from django.db.models.functions import Greatest, Concat
-from django.contrib.postgres.search import TrigramSimilarity
 import re
-from django.db.models import Q
 
 
 @api_view(['POST'])
@@ -31,25 +30,14 @@ def register_new_user(request):
     with_provider = request.data.pop('withProvider')
 
     if with_provider:
-        user = User.objects.create_user(**request.data)
-        user.email_verified = True
-        user.last_login = timezone.now()
-        user.save()
+        user = User.objects.create_user(**request.data, last_login=timezone.now(), email_verified=True)
         serializer = UserSerializer(user)
         return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
     with atomic():
         user = User.objects.create_user(**request.data)
-        html_string = render_to_string('email_verify.html',
-                                       {'link': f'{settings.CURRENT_FRONTEND_HOST}/verify/{user.get_auth_jwt()}'})
-        send_mail(
-            'GP-Email Verification',
-            'Verify your email at Golden Pens',
-            settings.DEFAULT_FROM_EMAIL,
-            [user.email],
-            html_message=html_string,
-            fail_silently=False
-        )
+        send_email.delay('GP-Email Verification', 'Verify your email at Golden Pens', [user.email], 'email_verify.html',
+                         {'link': f'{settings.CURRENT_FRONTEND_HOST}/verify/{user.get_auth_jwt()}'})
 
         return Response({"success": True, "message": "userCreated"}, status=status.HTTP_201_CREATED)
 
@@ -64,8 +52,7 @@ def authenticate_jwt(request):
         user = User.objects.get(pk=payload['pk'])
         if not user.is_active:
             return Response({'message': 'suspended', 'status': 403}, status=status.HTTP_403_FORBIDDEN)
-        user.last_login = timezone.now()
-        user.save()
+        record_login(user)
         serializer = UserSerializer(user)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
     except (jwt.DecodeError, ObjectDoesNotExist, jwt.ExpiredSignatureError):
@@ -86,15 +73,11 @@ def login_user(request):
             user = User.objects.get(email=email)
             if not user.with_provider():
                 return Response({'message': 'invalidCredits', "status": 401}, status=status.HTTP_401_UNAUTHORIZED)
-            user.last_login = timezone.now()
-            user.save()
+            record_login(user)
             serializer = UserSerializer(user)
             return Response(data=serializer.data, status=status.HTTP_200_OK)
         except ObjectDoesNotExist:
-            user = User.objects.create_user(**request.data)
-            user.last_login = timezone.now()
-            user.email_verified = True
-            user.save()
+            user = User.objects.create_user(**request.data, last_login=timezone.now(), email_verified=True)
             serializer = UserSerializer(user)
             return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -109,8 +92,7 @@ def login_user(request):
     if not user.is_active:
         return Response({'message': 'suspended', 'status': 403}, status=status.HTTP_403_FORBIDDEN)
 
-    user.last_login = timezone.now()
-    user.save()
+    record_login(user)
     serializer = UserSerializer(user)
     return Response(data=serializer.data, status=status.HTTP_200_OK)
 
@@ -127,13 +109,33 @@ def verify_email(request):
             return Response({'message': 'invalidToken', 'status': 401}, status=status.HTTP_401_UNAUTHORIZED)
         user.email_verified = True
         user.last_login = timezone.now()
-        user.save()
+        user.save(update_fields=['email_verified', 'last_login'])
         serializer = UserSerializer(user)
         return Response(data=serializer.data, status=status.HTTP_200_OK)
     except (ObjectDoesNotExist, jwt.DecodeError, jwt.ExpiredSignatureError):
         return Response({'message': 'invalidToken', 'status': 401}, status=status.HTTP_401_UNAUTHORIZED)
 
 
+@api_view(['POST'])
+@authentication_classes([TokenAuthentication])
+def refresh_access_token(request):
+    # The DRF token is the refresh credential, access tokens it hands out are checked without a query
+    return Response({'access': request.user.get_access_token(), 'expiresIn': settings.ACCESS_TOKEN_LIFETIME},
+                    status=status.HTTP_200_OK)
+
+
+@api_view(['POST'])
+def logout_user(request):
+    # Rotating the DRF token ends refreshes, the access tokens issued so far are revoked until they expire
+    now = timezone.now()
+    with atomic():
+        User.objects.filter(pk=request.user.pk).update(tokens_revoked=now)
+        Token.objects.filter(user__pk=request.user.pk).delete()
+        Token.objects.create(user_id=request.user.pk)
+    revocations.revoke(request.user.pk, now.timestamp())
+    return Response(status=status.HTTP_204_NO_CONTENT)
+
+
 @api_view(['POST'])
 @authentication_classes([])
 @permission_classes([])
@@ -148,22 +150,14 @@ def send_reset_request(request):
         with atomic():
             if user.reset_request_allowed():
                 token = user.get_auth_jwt()
-                html_string = render_to_string('request_reset.html', {
-                    'link': f'{settings.CURRENT_FRONTEND_HOST}/reset/{token}'
-                })
                 user.current_reset_token = token
                 user.save()
-                send_mail(
-                    'Password Reset Request',
-                    'You requested a password reset for your account',
-                    settings.DEFAULT_FROM_EMAIL,
-                    [user.email],
-                    fail_silently=False,
-                    html_message=html_string
-                )
+                send_email.delay('Password Reset Request', 'You requested a password reset for your account',
+                                 [user.email], 'request_reset.html',
+                                 {'link': f'{settings.CURRENT_FRONTEND_HOST}/reset/{token}'})
                 return Response({"message": "recoverPasswordSent", "success": True}, status=status.HTTP_200_OK)
             return Response({"message": "waitResetAllow", "status": 429}, status=status.HTTP_429_TOO_MANY_REQUESTS)
-    except (ObjectDoesNotExist, NotVerifiedError, SMTPException):
+    except (ObjectDoesNotExist, NotVerifiedError):
         return Response({"message": "emailNotExist", "status": 400}, status=status.HTTP_400_BAD_REQUEST)
 
 
@@ -199,31 +193,30 @@ def update_user(request, pk):
     if not validate_auth(request, pk, 'user'):
         return Response(status=status.HTTP_401_UNAUTHORIZED)
 
+    # The name is part of the search document of the user's stories, which are only rewritten when it changes
+    renamed = (user.first_name, user.last_name) != (first_name, last_name)
+
     if user.email != email:
         if user.social_id is not None:
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         if User.objects.filter(email=email).exists():
             return Response({"message": "emailExists", "status": 400}, status=status.HTTP_400_BAD_REQUEST)
         with atomic():
-            html_string = render_to_string('new_email_verify.html',
-                                           {'link': f'{settings.CURRENT_FRONTEND_HOST}/verifyC/{user.get_auth_jwt()}'})
-            send_mail(
-                'New Email Verification',
-                'Verify your new email at GP',
-                settings.DEFAULT_FROM_EMAIL,
-                [email],
-                html_message=html_string,
-                fail_silently=False
-            )
+            send_email.delay('New Email Verification', 'Verify your new email at GP', [email], 'new_email_verify.html',
+                             {'link': f'{settings.CURRENT_FRONTEND_HOST}/verifyC/{user.get_auth_jwt()}'})
             user.temp_email = email
             user.first_name = first_name
             user.last_name = last_name
             user.save()
+            if renamed:
+                index_author_stories.delay(user.pk)
             return Response({"success": True, "message": "userCreated"}, status=status.HTTP_200_OK)
     else:
         user.first_name = first_name
         user.last_name = last_name
         user.save()
+        if renamed:
+            index_author_stories.delay(user.pk)
         return Response({"success": True, "message": "saved"}, status=status.HTTP_200_OK)
 
 
@@ -282,25 +275,14 @@ def authors_list(request):
     search = request.GET.get('search')
     page = int(request.GET.get('p') or 1)
     size = 20
-    if search is not None:
-        queryset = Author.objects.annotate(fullname=Concat('user__first_name', Value(' '), 'user__last_name'),
-                                           similarity=Greatest(
-                                               TrigramSimilarity('fullname', search),
-                                               TrigramSimilarity('nickname', search)
-                                           ), stories_no=Count('stories')). \
-                       filter(Q(similarity__gte=0.1) & Q(stories_no__gte=1)).order_by('-similarity')[
-                   (page - 1) * size:page * size]
-    else:
-        queryset = Author.objects.annotate(top=Count('followers'), stories_no=Count('stories')). \
-                       filter(stories_no__gte=1).order_by('-top')[(page - 1) * size:page * size]
-    count = Author.objects.count()
+    queryset = Author.objects.directory(search=search, user_pk=user_pk)
+    count = queryset.count()
     total = count % size == 0 and count // size or (count // size) + 1
     response = {'total': total, 'results': []}
-    for record in queryset:
-        serializer = AuthorSimpleSerializer(record)
-        data = serializer.data
+    for record in queryset[(page - 1) * size:page * size]:
+        data = AuthorSimpleSerializer(record).data
         if user_pk is not None:
-            data['inFollowers'] = record.followers.filter(pk=user_pk).exists()
+            data['inFollowers'] = record.in_followers
         response['results'].append(data)
     return Response(response, status=status.HTTP_200_OK)
 
@@ -310,11 +292,11 @@ def authors_list(request):
 @permission_classes([])
 def user_profile(request, pk):
     user_pk = request.GET.get('user')
-    user = User.objects.get(pk=pk)
-    serializer = UserProfileSerializer(user)
+    data = cached_response(f'user_profile:{pk}', lambda: UserProfileSerializer(User.objects.get(pk=pk)).data,
+                           [f'author:{pk}'])
     if user_pk is not None:
-        serializer.data['author']['inFollowers'] = user.author.followers.filter(pk=user_pk).exists()
-    return Response(serializer.data, status=status.HTTP_200_OK)
+        data['author']['inFollowers'] = pk in followed_authors(user_pk)
+    return Response(data, status=status.HTTP_200_OK)
 
 
 @api_view(['POST'])
@@ -327,7 +309,11 @@ def delete_user(request, pk):
     try:
         user = User.objects.get(pk=pk)
         if user.check_password(password):
-            user.delete()
+            # The account is closed at once, its content is deleted in the background
+            with atomic():
+                user.is_active = False
+                user.save(update_fields=['is_active'])
+                delete_account.delay(user.pk)
             return Response(status=status.HTTP_204_NO_CONTENT)
         return Response(status=status.HTTP_401_UNAUTHORIZED)
     except ObjectDoesNotExist:
@@ -344,7 +330,12 @@ def update_media(request):
     user = User.objects.get(pk=user_pk)
     if picture is not None:
         user.picture = picture
+        user.picture_renditions = {}
     if cover is not None:
         user.cover = cover
+        user.cover_renditions = {}
     user.save()
+    for field, image in [('picture', picture), ('cover', cover)]:
+        if image is not None:
+            build_image_renditions.delay(user.pk, field)
     return Response({'success': True}, status=status.HTTP_200_OK)
@@ -0,0 +1,55 @@
+from django.conf import settings
+from django.db import connection
+import threading
+import atexit
+
+
+class WriteBuffer:
+    """Collects writes in memory and flushes them to the database in batches.
+
+    Entries are kept by key, a repeated key collapsing into one entry with the latest value. A batch is flushed
+    when it reaches the batch_size setting, if any, interval seconds after its first entry, when the process exits
+    or when flush() is called explicitly. Subclasses name those settings and write a batch in write(pending).
+    """
+    interval = None
+    batch_size = None
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+        atexit.register(self.flush)
+
+    def add(self, key, value=None):
+        with self._lock:
+            self._pending[key] = value
+            full = self.batch_size is not None and len(self._pending) >= getattr(settings, self.batch_size)
+            if not full and self._timer is None:
+                self._timer = threading.Timer(getattr(settings, self.interval), self._flush_in_background)
+                self._timer.daemon = True
+                self._timer.start()
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if pending:
+            self.write(pending)
+        return len(pending)
+
+    def write(self, pending):
+        raise NotImplementedError
+
+    def _flush_in_background(self):
+        try:
+            self.flush()
+        finally:
+            # The timer thread got its own connection, don't leave it open
+            connection.close()
+
+    def __len__(self):
+        return len(self._pending)
@@ -0,0 +1,162 @@
+"SQLite file cache backend shared by every worker process on the host"
+import itertools
+import os
+import pickle
+import sqlite3
+import threading
+import time
+
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+
+class SQLiteCache(BaseCache):
+    """Cache kept in a single SQLite file, so gunicorn workers share hits, invalidations and throttle counters.
+
+    LOCATION is the path of the file. Entries past MAX_ENTRIES are evicted least recently used first, a
+    1/CULL_FREQUENCY share at a time. Counting the entries scans the table, so it is only done once every CULL_EVERY
+    writes of a process (an OPTIONS key, 100 by default) and the table may briefly hold that many entries more.
+    Reads refresh an entry's recency at most once per LRU_RESOLUTION seconds (an OPTIONS key, 1 by default) so
+    that hot keys don't turn every read into a write.
+    """
+
+    pickle_protocol = pickle.HIGHEST_PROTOCOL
+
+    def __init__(self, location, params):
+        super().__init__(params)
+        self._path = location
+        options = params.get('OPTIONS', {})
+        self._lru_resolution = float(options.get('LRU_RESOLUTION', 1))
+        self._cull_every = int(options.get('CULL_EVERY', 100))
+        self._writes = itertools.count(1)
+        self._local = threading.local()
+
+    def _connection(self):
+        # One connection per thread and process, one opened before a fork must not be reused by the children
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self._path, timeout=5, isolation_level=None, check_same_thread=False)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, value BLOB NOT NULL, '
+                               'expires REAL, accessed REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS cache_accessed ON cache (accessed)')
+            self._local.connection, self._local.pid = connection, os.getpid()
+        return connection
+
+    def _key(self, key, version):
+        key = self.make_key(key, version=version)
+        self.validate_key(key)
+        return key
+
+    def _load(self, connection, key, now):
+        row = connection.execute('SELECT value, expires, accessed FROM cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        value, expires, accessed = row
+        if expires is not None and expires <= now:
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now))
+            return None
+        if accessed < now - self._lru_resolution:
+            connection.execute('UPDATE cache SET accessed = ? WHERE key = ?', (now, key))
+        return pickle.loads(value)
+
+    def _store(self, connection, key, value, timeout, mode):
+        now = time.time()
+        expires = self.get_backend_timeout(timeout)
+        value = pickle.dumps(value, self.pickle_protocol)
+        if mode == 'add':
+            # An expired entry doesn't block add()
+            connection.execute('DELETE FROM cache WHERE key = ? AND expires <= ?', (key, now))
+            stored = connection.execute('INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?)',
+                                        (key, value, expires, now)).rowcount
+        else:
+            stored = connection.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                                        (key, value, expires, now)).rowcount
+        if stored and next(self._writes) % self._cull_every == 0:
+            self._cull(connection, now)
+        return bool(stored)
+
+    def _cull(self, connection, now):
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count <= self._max_entries:
+            return
+        connection.execute('DELETE FROM cache WHERE expires <= ?', (now,))
+        count = connection.execute('SELECT COUNT(*) FROM cache').fetchone()[0]
+        if count > self._max_entries:
+            connection.execute('DELETE FROM cache WHERE key IN (SELECT key FROM cache ORDER BY accessed LIMIT ?)',
+                               (self._cull_frequency and count // self._cull_frequency or count,))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            return self._store(connection, key, value, timeout, 'add')
+
+    def get(self, key, default=None, version=None):
+        key = self._key(key, version)
+        value = self._load(self._connection(), key, time.time())
+        return default if value is None else value
+
+    def get_many(self, keys, version=None):
+        found = {}
+        connection = self._connection()
+        now = time.time()
+        for key in keys:
+            value = self._load(connection, self._key(key, version), now)
+            if value is not None:
+                found[key] = value
+        return found
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            self._store(connection, key, value, timeout, 'set')
+
+    def set_many(self, data, timeout=DEFAULT_TIMEOUT, version=None):
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            for key, value in data.items():
+                self._store(connection, self._key(key, version), value, timeout, 'set')
+        return []
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        key = self._key(key, version)
+        now = time.time()
+        return bool(self._connection().execute(
+            'UPDATE cache SET expires = ?, accessed = ? WHERE key = ? AND (expires IS NULL OR expires > ?)',
+            (self.get_backend_timeout(timeout), now, key, now)).rowcount)
+
+    def incr(self, key, delta=1, version=None):
+        # Read and write under one write lock so that concurrent workers don't lose increments
+        key = self._key(key, version)
+        connection = self._connection()
+        with connection:
+            connection.execute('BEGIN IMMEDIATE')
+            now = time.time()
+            value = self._load(connection, key, now)
+            if value is None:
+                raise ValueError("Key '%s' not found" % key)
+            value += delta
+            connection.execute('UPDATE cache SET value = ?, accessed = ? WHERE key = ?',
+                               (pickle.dumps(value, self.pickle_protocol), now, key))
+        return value
+
+    def delete(self, key, version=None):
+        key = self._key(key, version)
+        return bool(self._connection().execute('DELETE FROM cache WHERE key = ?', (key,)).rowcount)
+
+    def has_key(self, key, version=None):
+        key = self._key(key, version)
+        return self._connection().execute('SELECT 1 FROM cache WHERE key = ? AND (expires IS NULL OR expires > ?)',
+                                          (key, time.time())).fetchone() is not None
+
+    def clear(self):
+        self._connection().execute('DELETE FROM cache')
+
+    def close(self, **kwargs):
+        # Connections are kept open across requests, opening one costs more than most cache lookups
+        pass
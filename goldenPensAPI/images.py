@@ -0,0 +1,67 @@
+"Fixed size renditions of uploaded images, so that lists don't transfer the originals"
+from django.conf import settings
+from django.core.files.base import ContentFile
+from rest_framework.fields import Field
+from PIL import Image, ImageOps
+import io
+import os
+
+
+def render(image, size, image_format):
+    # exif_transpose applies the camera orientation to a copy, which carries no EXIF or ICC data over when saved
+    rendition = ImageOps.exif_transpose(image)
+    rendition.thumbnail(size, Image.LANCZOS)
+    if image_format == 'JPEG' and rendition.mode not in ['RGB', 'L']:
+        rendition = rendition.convert('RGB')
+    elif rendition.mode not in ['RGB', 'RGBA', 'L']:
+        rendition = rendition.convert('RGBA')
+    output = io.BytesIO()
+    rendition.save(output, image_format, quality=settings.IMAGE_RENDITION_QUALITY)
+    return output.getvalue()
+
+
+def build_renditions(image_file):
+    """Stores each of IMAGE_RENDITIONS next to the image through its storage, returns their names by rendition."""
+    image_format = settings.IMAGE_RENDITION_FORMAT
+    extension = image_format == 'JPEG' and 'jpg' or image_format.lower()
+    stem = os.path.splitext(image_file.name)[0]
+    with image_file.open('rb') as original:
+        image = Image.open(original)
+        image.load()
+    return {name: image_file.storage.save(f'{stem}_{name}.{extension}', ContentFile(render(image, size, image_format)))
+            for name, size in settings.IMAGE_RENDITIONS.items()}
+
+
+def store_renditions(model, pk, field, **updates):
+    """Builds the renditions of an instance's image and stores them in its <field>_renditions along with updates,
+    returns the instance, or None when it is gone or has no image.
+
+    Nothing is stored if the image was replaced meanwhile, the job queued for the new one builds its renditions.
+    """
+    instance = model.objects.filter(pk=pk).first()
+    image = instance and getattr(instance, field)
+    if not image:
+        return None
+    model.objects.filter(pk=pk, **{field: image.name}).update(**{f'{field}_renditions': build_renditions(image)},
+                                                               **updates)
+    return instance
+
+
+class RenditionsField(Field):
+    """The URLs of an image field's renditions, the original's standing in for those not built yet."""
+
+    def __init__(self, image, **kwargs):
+        super().__init__(source='*', read_only=True, **kwargs)
+        self.image = image
+
+    def to_representation(self, instance):
+        image = getattr(instance, self.image)
+        if not image:
+            return None
+        renditions = getattr(instance, f'{self.image}_renditions') or {}
+        request = self.context.get('request')
+        urls = {}
+        for name in settings.IMAGE_RENDITIONS:
+            url = name in renditions and image.storage.url(renditions[name]) or image.url
+            urls[name] = request is not None and request.build_absolute_uri(url) or url
+        return urls
@@ -0,0 +1,21 @@
+"Test runner of manage.py test"
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+import os
+
+
+class TestRunner(DiscoverRunner):
+    """Runs the tests against a cache file of their own, next to the configured one, so that the tests clearing
+    their cache don't clear a running server's."""
+
+    def setup_test_environment(self, **kwargs):
+        super().setup_test_environment(**kwargs)
+        cache = settings.CACHES['default']
+        location = '-test'.join(os.path.splitext(cache['LOCATION']))
+        self._test_cache = override_settings(CACHES={**settings.CACHES, 'default': {**cache, 'LOCATION': location}})
+        self._test_cache.enable()
+
+    def teardown_test_environment(self, **kwargs):
+        self._test_cache.disable()
+        super().teardown_test_environment(**kwargs)
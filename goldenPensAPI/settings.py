@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/3.0/ref/settings/
 """
 
 import os
+import tempfile
 import dj_database_url
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
@@ -44,7 +45,8 @@ INSTALLED_APPS = [
     'rest_framework',
     'rest_framework.authtoken',
     'authentication',
-    'stories'
+    'stories',
+    'jobs'
 ]
 
 MIDDLEWARE = [
@@ -155,6 +157,7 @@ if DEBUG:
 # DRF Default Settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        'authentication.tokens.AccessTokenAuthentication',
         'rest_framework.authentication.TokenAuthentication'
     ],
     'DEFAULT_PERMISSION_CLASSES': [
@@ -165,18 +168,22 @@ REST_FRAMEWORK = {
     }
 }
 
-# Cache Setup
+# Cache Setup, a SQLite file shared by the worker processes of the host (manage.py benchmark_cache compares it).
+# TEST_RUNNER gives manage.py test a file of its own
 CACHES = {
     'default': {
-        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'BACKEND': 'goldenPensAPI.cache.SQLiteCache',
+        'LOCATION': os.getenv('CACHE_FILE', os.path.join(tempfile.gettempdir(), 'goldenpens-cache.sqlite3')),
         'TIMEOUT': 600,
         'OPTIONS': {
-            'CULL_FREQUENCY': 2,
-            'MAX_ENTRIES': 600
+            'CULL_FREQUENCY': 4,
+            'MAX_ENTRIES': 20000
         }
     }
 }
 
+TEST_RUNNER = 'goldenPensAPI.runner.TestRunner'
+
 # Email (SMTP) Configurations
 if DEBUG:
     EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
@@ -192,6 +199,25 @@ DEFAULT_FROM_EMAIL = 'goldenpensapp@gmail.com'
 SERVER_EMAIL = DEFAULT_FROM_EMAIL
 EMAIL_SUBJECT_PREFIX = ''
 
+# Background jobs, run by manage.py run_jobs with JOBS_CONCURRENCY threads. A failed job is retried JOBS_RETRY_DELAY
+# seconds later, the delay doubling on each of its attempts. JOBS_EAGER runs them in the web process instead, once
+# the request's transaction commits. Batched jobs are claimed JOBS_BATCH_SIZE at a time
+JOBS_EAGER = os.getenv('JOBS_EAGER') == 'true'
+JOBS_CONCURRENCY = 2
+JOBS_POLL_INTERVAL = 1
+JOBS_MAX_ATTEMPTS = 5
+JOBS_RETRY_DELAY = 30
+JOBS_BATCH_SIZE = 50
+
+# Renditions built by a job for each uploaded story cover and profile image, fitted within their (width, height)
+IMAGE_RENDITIONS = {
+    'thumbnail': (160, 160),
+    'card': (400, 600),
+    'full': (1280, 1280),
+}
+IMAGE_RENDITION_FORMAT = 'WEBP'
+IMAGE_RENDITION_QUALITY = 80
+
 # Storage Configs
 if not DEBUG:
     # DROP BOX
@@ -212,5 +238,42 @@ PROD_HOST = 'https://musing-archimedes-08b9fb.netlify.app'
 LOCAL_HOST = 'http://localhost:3000'
 CURRENT_FRONTEND_HOST = DEBUG and LOCAL_HOST or PROD_HOST
 
+# Chapter views buffering, when enabled views are written in batches instead of one INSERT per request. The buffer
+# lives in each worker process, which flushes it once full, CHAPTER_VIEWS_FLUSH_INTERVAL seconds after its first
+# view and when the process exits
+BUFFER_CHAPTER_VIEWS = False
+CHAPTER_VIEWS_BUFFER_SIZE = 500
+CHAPTER_VIEWS_FLUSH_INTERVAL = 10
+
+# Trending snapshot scoring, refreshed by manage.py compute_trending
+TRENDING_WINDOW_DAYS = 7
+TRENDING_HALF_LIFE_HOURS = 24
+TRENDING_LOVE_WEIGHT = 3
+TRENDING_REPLY_WEIGHT = 5
+
+# Story list totals, cached per filter set and estimated by the planner above the threshold
+STORIES_COUNT_CACHE_TIMEOUT = 60
+STORIES_COUNT_ESTIMATE_THRESHOLD = 1000
+
+# Seconds a user's followed authors and loved chapters stay cached for the viewer state endpoint
+VIEWER_STATE_CACHE_TIMEOUT = 600
+
+# Seconds a public read response stays cached, saves of the objects it shows expire it earlier.
+# While one request rebuilds an expired response the others get the stale one, for up to RESPONSE_CACHE_STALE
+# seconds past expiry, or wait up to RESPONSE_CACHE_LOCK_TIMEOUT seconds when there is none
+RESPONSE_CACHE_TIMEOUT = 300
+RESPONSE_CACHE_STALE = 60
+RESPONSE_CACHE_LOCK_TIMEOUT = 10
+
+# Seconds an access token is valid for, and between reloads of the users whose tokens were revoked
+ACCESS_TOKEN_LIFETIME = 900
+ACCESS_TOKEN_REVOCATION_REFRESH = 30
+
+# Seconds within which a login doesn't update last_login again. When buffered, the stamps are written in one
+# UPDATE per LAST_LOGIN_FLUSH_INTERVAL seconds instead of one per login
+LAST_LOGIN_RESOLUTION = 3600
+BUFFER_LAST_LOGIN = False
+LAST_LOGIN_FLUSH_INTERVAL = 60
+
 # Admins Config
 ADMINS = [('Eldababa', 'abdotaker608@gmail.com')]
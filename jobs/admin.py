@@ -0,0 +1,17 @@
+from django.contrib import admin
+from django.utils import timezone
+from .models import Job
+
+
+class JobAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'name', 'queued', 'run_after', 'attempts', 'max_attempts']
+    search_fields = ['pk', 'name', 'error']
+    actions = ['requeue']
+
+    def requeue(self, request, queryset):
+        queryset.update(run_after=timezone.now(), attempts=0)
+
+    requeue.short_description = 'Requeue the selected jobs'
+
+
+admin.site.register(Job, JobAdmin)
@@ -0,0 +1,65 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.utils import timezone
+from jobs.models import Job
+from jobs.queue import run_next, run_pending
+import threading
+import signal
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = 'Runs the queued jobs with a pool of worker threads, polling for new ones until interrupted'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, help='Worker threads, JOBS_CONCURRENCY by default')
+        parser.add_argument('--interval', type=float, help='Seconds an idle worker waits between polls, '
+                                                           'JOBS_POLL_INTERVAL by default')
+        parser.add_argument('--once', action='store_true', help='Run the jobs that are due and exit')
+        parser.add_argument('--requeue-dead', action='store_true',
+                            help='Give the jobs that ran out of attempts a new round of attempts and exit')
+
+    def handle(self, *args, **options):
+        if options['requeue_dead']:
+            count = Job.objects.dead().update(run_after=timezone.now(), attempts=0)
+            self.stdout.write(f'Requeued {count} dead jobs')
+            return
+        if options['once']:
+            succeeded, failed = run_pending()
+            self.stdout.write(f'Ran {succeeded + failed} jobs, {failed} failed')
+            return
+
+        stopping = threading.Event()
+        interval = options['interval'] or settings.JOBS_POLL_INTERVAL
+        workers = [threading.Thread(target=self.work, args=(stopping, interval), name=f'jobs-{i}', daemon=True)
+                   for i in range(options['concurrency'] or settings.JOBS_CONCURRENCY)]
+        for worker in workers:
+            worker.start()
+        self.stdout.write(f'Running jobs with {len(workers)} workers')
+        signal.signal(signal.SIGTERM, lambda signum, frame: stopping.set())
+        try:
+            while not stopping.wait(1):
+                pass
+        except KeyboardInterrupt:
+            stopping.set()
+        # Jobs in progress are finished before exiting
+        for worker in workers:
+            worker.join()
+
+    @staticmethod
+    def work(stopping, interval):
+        try:
+            while not stopping.is_set():
+                try:
+                    ran = run_next()
+                except Exception:
+                    logger.exception('Claiming a job failed')
+                    connection.close()
+                    ran = None
+                if ran is None:
+                    stopping.wait(interval)
+        finally:
+            connection.close()
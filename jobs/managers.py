@@ -0,0 +1,12 @@
+from django.db import models
+from django.utils import timezone
+
+
+class JobManager(models.Manager):
+
+    def due(self):
+        # Jobs claimed by another worker are skipped rather than waited for
+        return self.select_for_update(skip_locked=True).filter(run_after__lte=timezone.now()).order_by('run_after')
+
+    def dead(self):
+        return self.filter(run_after__isnull=True)
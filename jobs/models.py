@@ -0,0 +1,41 @@
+from django.db import models
+from django.conf import settings
+from django.contrib.postgres.fields import JSONField
+from django.utils import timezone
+from django.utils.module_loading import import_string
+from datetime import timedelta
+from .managers import JobManager
+
+
+class Job(models.Model):
+    """A call to a function decorated with @job, run by manage.py run_jobs after the queuing transaction commits."""
+
+    name = models.CharField(max_length=200)
+    args = JSONField(default=list)
+    kwargs = JSONField(default=dict)
+    queued = models.DateTimeField(auto_now_add=True)
+    # Null once the job ran out of attempts, it then stays in the table as a dead letter along with its error
+    run_after = models.DateTimeField(default=timezone.now, null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    max_attempts = models.PositiveSmallIntegerField(default=1)
+    error = models.TextField(blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['run_after'])]
+
+    def __str__(self):
+        return f'{self.name} #{self.pk}'
+
+    def run(self, **extras):
+        return import_string(self.name)(*self.args, **self.kwargs, **extras)
+
+    def retry_later(self, error):
+        self.attempts += 1
+        self.error = repr(error)
+        if self.attempts >= self.max_attempts:
+            self.run_after = None
+        else:
+            delay = settings.JOBS_RETRY_DELAY * 2 ** (self.attempts - 1)
+            self.run_after = timezone.now() + timedelta(seconds=delay)
@@ -0,0 +1,97 @@
+from django.conf import settings
+from django.db import transaction
+from .models import Job
+import functools
+import logging
+
+logger = logging.getLogger(__name__)
+
+# The batch context manager and size of each batched function, by job name
+batches = {}
+
+
+def job(function=None, *, max_attempts=None, batch=None, batch_size=None):
+    """Lets a module level function be deferred with function.delay(*args, **kwargs).
+
+    The call is stored as a Job row in the caller's transaction, so it only runs if that transaction commits, and
+    its arguments must be JSON serializable, pks rather than model instances. A job that raises is retried after
+    JOBS_RETRY_DELAY seconds, doubling on each attempt, until it has run max_attempts times (JOBS_MAX_ATTEMPTS by
+    default). With JOBS_EAGER the call runs in process instead, once the caller's transaction commits.
+
+    With a batch context manager the worker runs the function's due jobs together, up to batch_size of them
+    (JOBS_BATCH_SIZE by default), inside a single batch(). The dict it yields is passed to each call as keyword
+    arguments, e.g. a connection the calls share rather than opening one each.
+    """
+    def decorator(function):
+        name = f'{function.__module__}.{function.__qualname__}'
+        if batch is not None:
+            batches[name] = (batch, batch_size)
+
+        @functools.wraps(function)
+        def delay(*args, **kwargs):
+            if settings.JOBS_EAGER:
+                transaction.on_commit(functools.partial(function, *args, **kwargs))
+                return None
+            return Job.objects.create(name=name, args=list(args), kwargs=kwargs,
+                                      max_attempts=max_attempts or settings.JOBS_MAX_ATTEMPTS)
+
+        function.delay = delay
+        return function
+    return decorator if function is None else decorator(function)
+
+
+def run(job, extras=None):
+    """Runs a claimed job in a savepoint, deletes it when it succeeds or schedules its retry, returns whether it did."""
+    try:
+        with transaction.atomic():
+            job.run(**(extras or {}))
+    except Exception as error:
+        logger.exception('Job %s failed', job)
+        job.retry_later(error)
+        job.save(update_fields=['attempts', 'run_after', 'error'])
+        return False
+    job.delete()
+    return True
+
+
+def run_next():
+    """Runs the oldest due job, along with the other due jobs of a batched function, returns None when there is
+    none, else how many succeeded and failed.
+
+    The jobs' rows stay locked while they run and each one's queries run in a savepoint, so a failed attempt leaves
+    nothing behind but the updated job, and the successful ones commit along with their jobs' deletion.
+    """
+    with transaction.atomic():
+        job = Job.objects.due().first()
+        if job is None:
+            return None
+        if job.name not in batches:
+            return (1, 0) if run(job) else (0, 1)
+
+        batch, size = batches[job.name]
+        others = Job.objects.due().filter(name=job.name).exclude(pk=job.pk)
+        jobs = [job, *others[:(size or settings.JOBS_BATCH_SIZE) - 1]]
+        results = []
+        try:
+            with batch() as extras:
+                for queued in jobs:
+                    results.append(run(queued, extras))
+        except Exception as error:
+            # Opening or closing the batch failed, the jobs it didn't get to run are retried later
+            logger.exception('Batch of %s failed', job.name)
+            skipped = jobs[len(results):]
+            for queued in skipped:
+                queued.retry_later(error)
+            Job.objects.bulk_update(skipped, ['attempts', 'run_after', 'error'])
+        succeeded = results.count(True)
+        return succeeded, len(jobs) - succeeded
+
+
+def run_pending():
+    """Runs the due jobs until there are none left, returns how many succeeded and failed."""
+    succeeded = failed = 0
+    while True:
+        result = run_next()
+        if result is None:
+            return succeeded, failed
+        succeeded, failed = succeeded + result[0], failed + result[1]
@@ -0,0 +1,133 @@
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import transaction
+from django.core.management import call_command
+from django.utils import timezone
+from .models import Job
+from .queue import job, run_next, run_pending
+from contextlib import contextmanager
+from io import StringIO
+
+calls = []
+batches = []
+
+
+@job
+def record(value, times=1):
+    calls.extend([value] * times)
+
+
+@job(max_attempts=2)
+def fail(value):
+    # Rolled back along with the failed attempt
+    record.delay(value)
+    raise ValueError(value)
+
+
+@contextmanager
+def collecting():
+    batches.append([])
+    yield {'batch': batches[-1]}
+
+
+@job(batch=collecting, batch_size=2)
+def collect(value, batch):
+    batch.append(value)
+
+
+@contextmanager
+def unavailable():
+    raise ConnectionError('unavailable')
+    yield
+
+
+@job(batch=unavailable)
+def unreachable(value):
+    pass
+
+
+class JobQueueTest(TestCase):
+
+    def setUp(self):
+        calls.clear()
+        batches.clear()
+
+    def test_delay_queues_job(self):
+        record.delay('a', times=2)
+        queued = Job.objects.get()
+        self.assertEqual(queued.name, 'jobs.tests.record')
+        self.assertEqual((queued.args, queued.kwargs), (['a'], {'times': 2}))
+        self.assertEqual(calls, [])
+
+    def test_runs_due_jobs_in_order(self):
+        record.delay('a')
+        record.delay('b', times=2)
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertEqual(calls, ['a', 'b', 'b'])
+        self.assertFalse(Job.objects.exists())
+        self.assertIsNone(run_next())
+
+    def test_retries_failed_job_later(self):
+        fail.delay('a')
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 1))
+        failed = Job.objects.get()
+        self.assertEqual(failed.name, 'jobs.tests.fail')
+        self.assertEqual(failed.attempts, 1)
+        self.assertGreater(failed.run_after, timezone.now())
+        self.assertIn('ValueError', failed.error)
+        # Not due again before its delay is over
+        self.assertIsNone(run_next())
+
+    def test_keeps_dead_letters(self):
+        fail.delay('a')
+        Job.objects.update(attempts=1)
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            run_pending()
+        self.assertEqual(Job.objects.dead().count(), 1)
+        out = StringIO()
+        call_command('run_jobs', requeue_dead=True, stdout=out)
+        self.assertIn('Requeued 1 dead jobs', out.getvalue())
+        self.assertEqual(Job.objects.dead().count(), 0)
+        self.assertEqual(Job.objects.get().attempts, 0)
+
+    def test_runs_batched_jobs_together(self):
+        for value in 'abc':
+            collect.delay(value)
+        self.assertEqual(run_pending(), (3, 0))
+        self.assertEqual(batches, [['a', 'b'], ['c']])
+        self.assertFalse(Job.objects.exists())
+
+    def test_retries_batch_that_fails_to_open(self):
+        unreachable.delay('a')
+        unreachable.delay('b')
+        with self.assertLogs('jobs.queue', 'ERROR'):
+            self.assertEqual(run_pending(), (0, 2))
+        self.assertEqual([job.attempts for job in Job.objects.all()], [1, 1])
+        self.assertTrue(all('unavailable' in job.error for job in Job.objects.all()))
+
+    def test_run_jobs_once(self):
+        record.delay('a')
+        out = StringIO()
+        call_command('run_jobs', once=True, stdout=out)
+        self.assertEqual(calls, ['a'])
+        self.assertIn('Ran 1 jobs, 0 failed', out.getvalue())
+
+
+@override_settings(JOBS_EAGER=True)
+class EagerJobTest(TransactionTestCase):
+
+    def setUp(self):
+        calls.clear()
+
+    def test_runs_once_committed(self):
+        with transaction.atomic():
+            record.delay('a')
+            self.assertEqual(calls, [])
+        self.assertEqual(calls, ['a'])
+        self.assertFalse(Job.objects.exists())
+
+    def test_skips_rolled_back(self):
+        with self.assertRaises(ValueError), transaction.atomic():
+            record.delay('a')
+            raise ValueError('a')
+        self.assertEqual(calls, [])
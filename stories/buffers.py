@@ -0,0 +1,18 @@
+from goldenPensAPI.buffers import WriteBuffer
+from .models import ChapterView
+
+
+class ViewBuffer(WriteBuffer):
+    """Chapter views, written with one INSERT per batch."""
+    interval = 'CHAPTER_VIEWS_FLUSH_INTERVAL'
+    batch_size = 'CHAPTER_VIEWS_BUFFER_SIZE'
+
+    def add(self, chapter_id, viewer):
+        # Repeated views of the same chapter by the same viewer collapse into one row
+        super().add((chapter_id, viewer))
+
+    def write(self, pending):
+        ChapterView.objects.record_many(pending)
+
+
+view_buffer = ViewBuffer()
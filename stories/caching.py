@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import QuerySet
+from rest_framework.response import Response
+from functools import wraps
+import inspect
+import math
+import random
+import time
+
+
+def version_key(dependency):
+    return f'version:{dependency}'
+
+
+def bump(*dependencies):
+    """Invalidates every cached response built from the given dependencies, e.g. bump('story:3', 'stories')."""
+    for dependency in dependencies:
+        try:
+            cache.incr(version_key(dependency))
+        except ValueError:
+            # Never versioned yet, or evicted, in which case no entry can match the fresh value anyway
+            cache.set(version_key(dependency), time.time_ns(), None)
+
+
+def current_versions(dependencies):
+    keys = [version_key(dependency) for dependency in dependencies]
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, time.time_ns(), None)
+            versions[key] = cache.get(key)
+    return versions
+
+
+def is_fresh(entry):
+    versions, data, expires, duration = entry
+    # Probabilistic early refresh: the closer to expiry and the slower the build, the likelier one request
+    # rebuilds ahead of time, so entries rarely expire under load at all
+    if time.time() - duration * math.log(1 - random.random()) >= expires:
+        return False
+    return cache.get_many(list(versions)) == versions
+
+
+def coalesced(key, build, dependencies, timeout=None):
+    """Returns the data cached under key, letting a single caller rebuild it when it is missing or stale.
+
+    Bumping any of the dependencies, a list or a function returning one that is only called to rebuild, makes the
+    entry stale. Their versions are read before build() runs, so a bump during the build leaves the entry stale too.
+    While one caller rebuilds, the others are served the stale data for up to RESPONSE_CACHE_STALE seconds past
+    expiry, or wait for the rebuild when there is none, instead of all hitting the database at once.
+    """
+    timeout = timeout or settings.RESPONSE_CACHE_TIMEOUT
+    entry = cache.get(key)
+    if entry is not None and is_fresh(entry):
+        return entry[1]
+
+    lock = f'lock:{key}'
+    owner = cache.add(lock, True, settings.RESPONSE_CACHE_LOCK_TIMEOUT)
+    if not owner:
+        if entry is not None:
+            return entry[1]
+        deadline = time.time() + settings.RESPONSE_CACHE_LOCK_TIMEOUT
+        while time.time() < deadline and cache.get(lock):
+            time.sleep(0.05)
+            entry = cache.get(key)
+            if entry is not None:
+                return entry[1]
+        # The lock may have been released since the last look, by a rebuild that stored the entry
+        entry = cache.get(key)
+        if entry is not None:
+            return entry[1]
+
+    try:
+        started = time.time()
+        versions = current_versions(dependencies() if callable(dependencies) else dependencies)
+        data = build()
+        duration = time.time() - started
+        cache.set(key, (versions, data, started + timeout, duration), timeout + settings.RESPONSE_CACHE_STALE)
+    finally:
+        if owner:
+            cache.delete(lock)
+    return data
+
+
+def cached_response(key, build, dependencies):
+    """Response data cached per route and object. Personalized fields are added on top of it by the views."""
+    return coalesced(f'response:{key}', build, dependencies)
+
+
+def single_flight(key, dependencies=(), timeout=None):
+    """Caches what the decorated view or function returns through coalesced().
+
+    key and dependencies are formatted with the call's arguments, e.g. single_flight('latest:{limit}', ['stories']).
+    Views have their response data cached, querysets are cached as the list of their rows.
+    """
+    def decorator(function):
+        signature = inspect.signature(function)
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            arguments = signature.bind(*args, **kwargs)
+            arguments.apply_defaults()
+
+            def build():
+                result = function(*args, **kwargs)
+                response = isinstance(result, Response)
+                if response:
+                    result = result.data
+                elif isinstance(result, QuerySet):
+                    result = list(result)
+                return response, result
+
+            response, data = coalesced(f'flight:{key.format(**arguments.arguments)}', build,
+                                       [dependency.format(**arguments.arguments) for dependency in dependencies],
+                                       timeout)
+            return response and Response(data) or data
+        return wrapper
+    return decorator
@@ -0,0 +1,89 @@
+"""ETag and Last-Modified functions for django.views.decorators.http.condition on the story and chapter reads.
+
+story_overview and chapter_view serve cached response data, so their ETags hash that very data, loaded once per
+request and shared with the view: the ETag changes exactly when the body does, and a repeat reader is answered 304
+from the cache alone. The chapter lists run a single narrow query for their validators instead.
+"""
+from django.db.models import Max, Count
+from .models import Story, Chapter
+from .serializers import StorySerializer, ChapterSerializer
+from .caching import cached_response
+from .state import followed_authors, loved_chapters
+import hashlib
+import json
+
+
+def memoized(request, name, fetch):
+    validators = getattr(request, '_validators', None)
+    if validators is None:
+        validators = request._validators = {}
+    if name not in validators:
+        validators[name] = fetch()
+    return validators[name]
+
+
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def story_overview_data(request, pk):
+    def build():
+        story = Story.advanced.overview().get(id=pk)
+        story.author.followers_total = story.author_followers
+        return StorySerializer(story).data
+
+    def dependencies():
+        # Looked up ahead of the build, whose dependency versions must be read before it runs
+        return [f'story:{pk}', f"author:{Story.objects.values_list('author_id', flat=True).get(pk=pk)}"]
+
+    return memoized(request, 'story', lambda: cached_response(f'story_overview:{pk}', build, dependencies))
+
+
+def chapter_view_data(request, pk):
+    def build():
+        chapter = Chapter.objects.overview().get(id=pk)
+        chapter.story.author.followers_total = chapter.author_followers
+        return ChapterSerializer(chapter).data
+
+    def dependencies():
+        story, author = Chapter.objects.values_list('story_id', 'story__author_id').get(pk=pk)
+        return [f'chapter:{pk}', f'story:{story}', f'author:{author}']
+
+    return memoized(request, 'chapter', lambda: cached_response(f'chapter_view:{pk}', build, dependencies))
+
+
+def data_etag(data, *personalization):
+    return make_etag(json.dumps(data, sort_keys=True, default=str), *personalization)
+
+
+def chapters_validators(request, pk):
+    return memoized(request, 'chapters', lambda: Chapter.objects.filter(story__pk=pk).aggregate(
+        updated=Max('updated'), count=Count('pk'), last=Max('pk')))
+
+
+def viewer(request, author_id, chapter_id=None):
+    # The personalized fields are part of the representation, so they are part of its ETag too
+    user_pk = request.GET.get('user')
+    if user_pk is None:
+        return None
+    return author_id in followed_authors(user_pk), chapter_id is not None and chapter_id in loved_chapters(user_pk)
+
+
+def story_etag(request, pk):
+    data = story_overview_data(request, pk)
+    return data_etag(data, viewer(request, data['author']['user']['pk']))
+
+
+def chapter_etag(request, pk):
+    data = chapter_view_data(request, pk)
+    return data_etag(data, viewer(request, data['story']['author']['user']['pk'], pk))
+
+
+def chapters_etag(request, pk):
+    chapters = chapters_validators(request, pk)
+    if chapters['count']:
+        return make_etag(sorted(chapters.items()))
+
+
+def chapters_last_modified(request, pk):
+    return chapters_validators(request, pk)['updated']
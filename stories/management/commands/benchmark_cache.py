@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.core.management.commands.createcachetable import Command as CreateCacheTable
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.cache.backends.db import DatabaseCache
+from django.db import connection
+from goldenPensAPI.cache import SQLiteCache
+import tempfile
+import time
+import os
+
+
+class Command(BaseCommand):
+    help = 'Compares the throughput of the SQLite cache backend with the locmem and database ones'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ops', type=int, default=2000, help='Operations timed per backend and operation')
+
+    def handle(self, *args, **options):
+        ops = options['ops']
+        params = {'TIMEOUT': 600, 'OPTIONS': {'MAX_ENTRIES': ops * 2}}
+        table = 'benchmark_cache_table'
+        create = CreateCacheTable()
+        create.verbosity = 0
+        create.create_table('default', table, False)
+        with tempfile.TemporaryDirectory() as directory:
+            backends = [
+                ('locmem', LocMemCache('benchmark', params)),
+                ('database', DatabaseCache(table, params)),
+                ('sqlite', SQLiteCache(os.path.join(directory, 'cache.sqlite3'), params)),
+            ]
+            try:
+                self.stdout.write(f"{'backend':<10}{'set/s':>12}{'get/s':>12}{'get_many/s':>12}{'incr/s':>12}")
+                for name, cache in backends:
+                    rates = self.measure(cache, ops)
+                    self.stdout.write(f'{name:<10}' + ''.join(f'{rate:>12.0f}' for rate in rates))
+            finally:
+                with connection.cursor() as cursor:
+                    cursor.execute(f'DROP TABLE {table}')
+
+    @staticmethod
+    def measure(cache, ops):
+        value = {'results': [{'id': i, 'title': f'Story {i}'} for i in range(9)], 'total': 12}
+        keys = [f'response:story_overview:{i}' for i in range(ops)]
+        rates = []
+
+        start = time.perf_counter()
+        for key in keys:
+            cache.set(key, value)
+        rates.append(ops / (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        for key in keys:
+            cache.get(key)
+        rates.append(ops / (time.perf_counter() - start))
+
+        start = time.perf_counter()
+        for i in range(0, ops, 10):
+            cache.get_many(keys[i:i + 10])
+        rates.append(ops / 10 / (time.perf_counter() - start))
+
+        cache.set('version:stories', 0)
+        start = time.perf_counter()
+        for _ in range(ops):
+            cache.incr('version:stories')
+        rates.append(ops / (time.perf_counter() - start))
+
+        cache.clear()
+        return rates
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+from stories.models import Story, build_cover_renditions
+from authentication.models import User, build_image_renditions
+
+
+class Command(BaseCommand):
+    help = 'Queues rendition jobs for the story covers and profile images uploaded before renditions were built'
+
+    def handle(self, *args, **options):
+        count = 0
+        with atomic():
+            for pk in Story.objects.exclude(cover='').filter(cover_renditions={}).values_list('pk', flat=True):
+                build_cover_renditions.delay(pk)
+                count += 1
+            for field in ['picture', 'cover']:
+                users = User.objects.exclude(**{field: ''}).exclude(**{f'{field}__isnull': True})\
+                    .filter(**{f'{field}_renditions': {}})
+                for pk in users.values_list('pk', flat=True):
+                    build_image_renditions.delay(pk, field)
+                    count += 1
+        self.stdout.write(f'Queued {count} rendition jobs')
@@ -0,0 +1,10 @@
+from django.core.management.base import BaseCommand
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the trending snapshot from the recent views, loves and replies of stories'
+
+    def handle(self, *args, **options):
+        count = Story.advanced.compute_trending()
+        self.stdout.write(f'Scored {count} trending stories')
@@ -0,0 +1,13 @@
+from django.core.management.base import BaseCommand
+from stories.models import Story
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the views, loves and replies counters of chapters and stories from their source rows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--story', type=int, help='Only recount the given story and its chapters')
+
+    def handle(self, *args, **options):
+        Story.advanced.recount_stats(pk=options['story'])
+        self.stdout.write('Stats recounted')
@@ -1,93 +1,271 @@
-from django.db import models
-from django.db.models import Count, Q, Value
-from django.db.models.functions import Concat, Greatest
-from django.contrib.postgres.search import TrigramSimilarity
+from django.db import models, connection
+from django.db.models import Count, Value, Sum, Max, OuterRef, Subquery, Func, F, FloatField, \
+    ExpressionWrapper
+from django.db.transaction import atomic
+from django.conf import settings
+from django.utils import timezone
+from django.db.models.functions import Concat, Coalesce, Cast
+from django.contrib.postgres.search import SearchVector, SearchQuery, SearchRank
+from authentication.models import Author
+from authentication.managers import followers_total
+from .caching import bump
 from urllib.parse import unquote
 import datetime
 
 
+class Decay(Func):
+    # Halves the weight of a timestamped event every half_life seconds
+    template = 'POWER(0.5, EXTRACT(EPOCH FROM (NOW() - %(expressions)s)) / %(half_life)s)'
+    output_field = FloatField()
+
+
+def search_document(story=None):
+    # Everything find() searches through, kept in Story.search_document so searching is a single GIN index lookup.
+    # Given a story, the document is built from its values rather than its columns, so an INSERT can include it
+    if story is None:
+        author, title, category, description = OuterRef('author'), F('title'), F('category'), F('description')
+        tags = Func(F('tags'), Value(' '), function='array_to_string', output_field=models.TextField())
+    else:
+        author = story.author_id
+        title, tags, category, description = (Value(value, output_field=models.TextField()) for value in (
+            story.title, ' '.join(story.tags or []), story.category, story.description))
+    author_name = Author.objects.filter(pk=author).annotate(name=Concat(
+        Coalesce('nickname', Value('')), Value(' '), 'user__first_name', Value(' '), 'user__last_name',
+        output_field=models.TextField())).values('name')
+    return SearchVector(title, Subquery(author_name), weight='A', config='english') + \
+        SearchVector(tags, weight='B', config='english') + \
+        SearchVector(category, weight='C', config='english') + \
+        SearchVector(description, weight='D', config='english')
+
+
 class StoryManager(models.Manager):
 
+    def listing(self):
+        # Story cards show the author's name and picture
+        return self.model.objects.select_related('author__user')
+
     def find(self, search=None, cat=None, sub_cat=None, sub_cat_ar=None, sort='-created',
              follower_pk=None, author_id=None):
 
-        queryset = self.model.objects
+        queryset = self.listing()
 
         if author_id is not None:
             queryset = queryset.filter(author__pk=author_id)
 
         if follower_pk is not None:
-            queryset = queryset.filter(author__followers__pk=follower_pk)
+            queryset = queryset.filter(feed_entries__user__pk=follower_pk)
 
         if cat is not None:
             queryset = queryset.filter(category=cat)
 
-        if search is not None or sub_cat is not None:
-
-            query_conditions = Q(similarity__gte=0.1) | Q(name_similarity__gte=0.1)
-
-            if search:
-                query_conditions |= Q(category__trigram_similar=search)
-
-            for i in range(30):
-                if search is not None:
-                    query_conditions |= Q(**{f'tags__{i}__trigram_similar': search})
-                if sub_cat is not None:
-                    query_conditions |= Q(**{f'tags__{i}__trigram_similar': sub_cat}) |\
-                                        Q(**{f'tags__{i}__trigram_similar': unquote(u"%s" % sub_cat_ar)})
-
-            queryset = queryset.annotate(fullname=Concat('author__user__first_name', Value(' '),
-                                                         'author__user__last_name')) \
-                .annotate(similarity=Greatest(
-                        TrigramSimilarity('title', search),
-                        TrigramSimilarity('title', sub_cat),
-                ), name_similarity=Greatest(
-                        TrigramSimilarity('fullname', search),
-                        TrigramSimilarity('author__nickname', search)
-                )).filter(query_conditions)
+        if search or sub_cat:
+            query = None
+            for term in [search, sub_cat, sub_cat_ar and unquote(sub_cat_ar)]:
+                if term:
+                    term_query = SearchQuery(term, config='english')
+                    query = query is None and term_query or query | term_query
+            queryset = queryset.filter(search_document=query)\
+                .annotate(rank=Cast(SearchRank(F('search_document'), query), FloatField()))
 
         if sort == 'relevance':
-            if search is not None or sub_cat is not None:
-                return queryset.order_by('-similarity', '-name_similarity')
+            if search or sub_cat:
+                return queryset.order_by('-rank', '-created')
             else:
                 return queryset.order_by('-created')
         elif sort == 'mostViewed':
-            return queryset.annotate(trend=Count('chapters__views')).order_by('-trend', '-created')
+            return queryset.order_by('-view_count', '-created')
         elif sort == 'trending':
             expired = datetime.date.today() - datetime.timedelta(days=7)
-            return queryset.filter(created__date__gte=expired).\
-                annotate(trend=Count('chapters__views')).order_by('-trend', '-created')
+            return queryset.filter(created__date__gte=expired, trending__isnull=False)\
+                .order_by('-trending__score', '-created')
         else:
             return queryset.order_by(sort)
 
+    def index_search(self, **filters):
+        self.model.objects.filter(**filters).update(search_document=search_document())
+
+    def overview(self):
+        return self.select_related('author__user').annotate(author_followers=followers_total('author'))
+
     def trending(self, limit=None):
         expired = datetime.date.today() - datetime.timedelta(days=7)
+        queryset = self.listing().filter(created__date__gte=expired, trending__isnull=False)\
+            .order_by('-trending__score', '-created')
         if limit is not None:
-            queryset = self.model.objects.filter(created__date__gte=expired).annotate(trend=Count('chapters__views'))\
-                        .order_by('-trend', '-created')[:limit]
-        else:
-            queryset = self.model.objects.filter(created__date__gte=expired).annotate(trend=Count('chapters__views'))\
-                        .order_by('-trend', '-created')
+            queryset = queryset[:limit]
         return queryset
 
+    def compute_trending(self):
+        from .models import ChapterView, Reply, TrendingSnapshot
+
+        since = timezone.now() - datetime.timedelta(days=settings.TRENDING_WINDOW_DAYS)
+        half_life = settings.TRENDING_HALF_LIFE_HOURS * 3600
+        stories = self.model.objects.filter(created__gte=since)
+
+        def decayed(model):
+            return dict(model.objects.filter(chapter__story__in=stories, created__gte=since)
+                        .values('chapter__story').annotate(score=Sum(Decay('created', half_life=half_life)))
+                        .values_list('chapter__story', 'score'))
+
+        views = decayed(ChapterView)
+        replies = decayed(Reply)
+        # Loves carry no timestamp, they decay with the age of the story instead
+        loves = stories.annotate(score=ExpressionWrapper(F('love_count') * Decay('created', half_life=half_life),
+                                                         output_field=FloatField())).values_list('pk', 'score')
+
+        snapshot = [TrendingSnapshot(story_id=pk, score=views.get(pk, 0) +
+                                     settings.TRENDING_LOVE_WEIGHT * love_score +
+                                     settings.TRENDING_REPLY_WEIGHT * replies.get(pk, 0))
+                    for pk, love_score in loves]
+        with atomic():
+            TrendingSnapshot.objects.all().delete()
+            TrendingSnapshot.objects.bulk_create(snapshot)
+        bump('trending')
+        return len(snapshot)
+
     def latest(self, limit=None):
         if limit is not None:
-            queryset = self.model.objects.order_by('-created')[:limit]
+            queryset = self.listing().order_by('-created')[:limit]
         else:
-            queryset = self.model.objects.order_by('-created')
+            queryset = self.listing().order_by('-created')
 
         return queryset
 
     def personal(self, pk, sort='-created', limit=None):
         if limit is not None:
-            queryset = self.model.objects.filter(author__pk=pk).order_by(sort)[:limit]
+            queryset = self.listing().filter(author__pk=pk).order_by(sort)[:limit]
         else:
-            queryset = self.model.objects.filter(author__pk=pk).order_by(sort)
+            queryset = self.listing().filter(author__pk=pk).order_by(sort)
         return queryset
 
-    def following(self, pk, sort='-created', limit=None):
+    def following(self, pk, sort='-feed_entries__created', limit=None):
+        # Read from the user's feed, filled in when followed authors publish, instead of joining their followers
         if limit is not None:
-            queryset = self.model.objects.filter(author__followers__pk=pk).order_by(sort)[:limit]
+            queryset = self.listing().filter(feed_entries__user__pk=pk).order_by(sort)[:limit]
         else:
-            queryset = self.model.objects.filter(author__followers__pk=pk).order_by(sort)
+            queryset = self.listing().filter(feed_entries__user__pk=pk).order_by(sort)
         return queryset
+
+    def recount_stats(self, pk=None):
+        from .models import Chapter
+
+        chapters = Chapter.objects.all()
+        stories = self.model.objects.all()
+        if pk is not None:
+            chapters = chapters.filter(story__pk=pk)
+            stories = stories.filter(pk=pk)
+        Chapter.objects.recount_stats(chapters)
+        self.roll_up_stats(stories)
+
+    def roll_up_stats(self, queryset):
+        from .models import Chapter
+
+        def total(field):
+            return Coalesce(Subquery(Chapter.objects.filter(story=OuterRef('pk')).order_by().values('story')
+                                     .annotate(total=Sum(field)).values('total')), 0)
+
+        queryset.update(view_count=total('view_count'), love_count=total('love_count'),
+                        reply_count=total('reply_count'))
+
+
+class ChapterManager(models.Manager):
+
+    def recount_stats(self, queryset, fields=('view_count', 'love_count', 'reply_count')):
+        from .models import ChapterView, Reply
+
+        rows = {'view_count': ChapterView.objects, 'love_count': self.model.loves.through.objects,
+                'reply_count': Reply.objects}
+
+        def count(counted):
+            return Coalesce(Subquery(counted.filter(chapter=OuterRef('pk')).order_by().values('chapter')
+                                     .annotate(total=Count('*')).values('total')), 0)
+
+        queryset.update(**{field: count(rows[field]) for field in fields})
+
+    def recount_and_roll_up(self, pks, fields):
+        # Counted from the rows rather than adjusted by a delta, for changes whose size isn't known
+        story_model = self.model._meta.get_field('story').related_model
+        with atomic():
+            self.recount_stats(self.filter(pk__in=pks), fields)
+            story_model.advanced.roll_up_stats(story_model.objects.filter(chapters__pk__in=pks))
+
+    def lock_last_number(self, story_id):
+        # Locking the story row serializes the numbering of its concurrently created chapters
+        story_model = self.model._meta.get_field('story').related_model
+        last = self.filter(story=OuterRef('pk')).order_by().values('story').annotate(last=Max('number')).values('last')
+        return story_model.objects.select_for_update().filter(pk=story_id).annotate(last=Subquery(last))\
+            .values_list('last', flat=True).get() or 0
+
+    def with_neighbours(self):
+        # Previous and next chapter ids resolved in the same query, nearest numbers so gaps left by deletes are skipped
+        chapters = self.model.objects.filter(story=OuterRef('story'))
+        return self.annotate(
+            prev_id=Subquery(chapters.filter(number__lt=OuterRef('number')).order_by('-number').values('pk')[:1]),
+            next_id=Subquery(chapters.filter(number__gt=OuterRef('number')).order_by('number').values('pk')[:1])
+        )
+
+    def overview(self):
+        return self.with_neighbours().select_related('story__author__user')\
+            .annotate(author_followers=followers_total('story__author'))
+
+    def bulk_create_numbered(self, story_id, chapters):
+        with atomic():
+            last = self.lock_last_number(story_id)
+            for number, chapter in enumerate(chapters, last + 1):
+                chapter.story_id = story_id
+                chapter.number = number
+            chapters = self.bulk_create(chapters)
+        # bulk_create sends no post_save
+        bump(f'story:{story_id}')
+        return chapters
+
+
+class ChapterViewManager(models.Manager):
+
+    def record(self, chapter_id, viewer):
+        self.record_many([(chapter_id, viewer)])
+
+    def record_many(self, views):
+        chapter_model = self.model._meta.get_field('chapter').related_model
+        story_model = chapter_model._meta.get_field('story').related_model
+        chapter_ids, viewers = zip(*views) if views else ((), ())
+
+        # One statement inserts the new views and bumps the chapter and story counters by what was actually
+        # inserted, the unique (chapter, viewer) constraint does the dedup and views of deleted chapters are skipped
+        with connection.cursor() as cursor:
+            cursor.execute(f"""
+                WITH inserted AS (
+                    INSERT INTO {self.model._meta.db_table} (chapter_id, viewer, created)
+                    SELECT v.chapter_id, v.viewer, now()
+                    FROM unnest(%s::integer[], %s::varchar[]) AS v(chapter_id, viewer)
+                    JOIN {chapter_model._meta.db_table} c ON c.id = v.chapter_id
+                    ON CONFLICT DO NOTHING
+                    RETURNING chapter_id
+                ), chapters AS (
+                    UPDATE {chapter_model._meta.db_table} c SET view_count = c.view_count + i.total
+                    FROM (SELECT chapter_id, count(*) AS total FROM inserted GROUP BY chapter_id) i
+                    WHERE c.id = i.chapter_id
+                    RETURNING c.story_id, i.total
+                )
+                UPDATE {story_model._meta.db_table} s SET view_count = s.view_count + t.total
+                FROM (SELECT story_id, sum(total) AS total FROM chapters GROUP BY story_id) t
+                WHERE s.id = t.story_id
+            """, [list(chapter_ids), list(viewers)])
+
+
+class FeedEntryManager(models.Manager):
+
+    def fan_out(self, story):
+        followers = Author.followers.through.objects.filter(author__pk=story.author_id).values_list('user', flat=True)
+        self.bulk_create([self.model(user_id=user_pk, story=story, created=story.created) for user_pk in followers],
+                         batch_size=1000, ignore_conflicts=True)
+
+    def follow(self, user_pk, author_pk):
+        # Backfills the feed with what the author published before being followed
+        from .models import Story
+        stories = Story.objects.filter(author__pk=author_pk).values_list('pk', 'created')
+        self.bulk_create([self.model(user_id=user_pk, story_id=story_pk, created=created)
+                          for story_pk, created in stories], batch_size=1000, ignore_conflicts=True)
+
+    def unfollow(self, user_pk, author_pk):
+        self.filter(user__pk=user_pk, story__author__pk=author_pk).delete()
@@ -0,0 +1,44 @@
+# Generated by Django 3.0.7 on 2026-10-17 19:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def move_views(apps, schema_editor):
+    Chapter = apps.get_model('stories', 'Chapter')
+    ChapterView = apps.get_model('stories', 'ChapterView')
+    batch = []
+    for chapter_id, views in Chapter.objects.values_list('pk', 'views').iterator():
+        batch.extend(ChapterView(chapter_id=chapter_id, viewer=viewer) for viewer in set(views) if viewer)
+        if len(batch) >= 1000:
+            ChapterView.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    ChapterView.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0014_auto_20210131_2128'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChapterView',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('viewer', models.CharField(max_length=500)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('chapter', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='views', to='stories.Chapter')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='chapterview',
+            constraint=models.UniqueConstraint(fields=('chapter', 'viewer'), name='unique_chapter_viewer'),
+        ),
+        migrations.RunPython(move_views, migrations.RunPython.noop),
+        migrations.RemoveField(
+            model_name='chapter',
+            name='views',
+        ),
+    ]
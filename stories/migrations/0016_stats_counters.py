@@ -0,0 +1,66 @@
+# Generated by Django 3.0.7 on 2026-10-17 19:24
+
+from django.db import migrations, models
+from django.db.models import Count, Sum, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_stats(apps, schema_editor):
+    Story = apps.get_model('stories', 'Story')
+    Chapter = apps.get_model('stories', 'Chapter')
+    ChapterView = apps.get_model('stories', 'ChapterView')
+    Reply = apps.get_model('stories', 'Reply')
+
+    def count(model):
+        return Coalesce(Subquery(model.objects.filter(chapter=OuterRef('pk')).order_by().values('chapter')
+                                 .annotate(total=Count('*')).values('total')), 0)
+
+    def total(field):
+        return Coalesce(Subquery(Chapter.objects.filter(story=OuterRef('pk')).order_by().values('story')
+                                 .annotate(total=Sum(field)).values('total')), 0)
+
+    Chapter.objects.update(view_count=count(ChapterView), love_count=count(Chapter.loves.through),
+                           reply_count=count(Reply))
+    Story.objects.update(view_count=total('view_count'), love_count=total('love_count'),
+                         reply_count=total('reply_count'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0015_chapterview'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chapter',
+            name='love_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='reply_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='chapter',
+            name='view_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='love_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='reply_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='view_count',
+            field=models.IntegerField(default=0, editable=False),
+        ),
+        migrations.RunPython(count_stats, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.0.7 on 2026-10-17 19:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0016_stats_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingSnapshot',
+            fields=[
+                ('story', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='trending', serialize=False, to='stories.Story')),
+                ('score', models.FloatField(db_index=True)),
+                ('computed', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+    ]
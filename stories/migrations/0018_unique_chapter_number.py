@@ -0,0 +1,31 @@
+# Generated by Django 3.0.7 on 2026-10-17 19:28
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicates(apps, schema_editor):
+    # Concurrent creates could give two chapters of a story the same number, renumber those stories in order
+    Chapter = apps.get_model('stories', 'Chapter')
+    stories = Chapter.objects.filter(number__isnull=False).values('story', 'number').annotate(total=Count('pk'))\
+        .filter(total__gt=1).values_list('story', flat=True)
+    for story_id in set(stories):
+        chapters = list(Chapter.objects.filter(story_id=story_id, number__isnull=False).order_by('number', 'pk'))
+        for number, chapter in enumerate(chapters, 1):
+            chapter.number = number
+        Chapter.objects.bulk_update(chapters, ['number'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0017_trendingsnapshot'),
+    ]
+
+    operations = [
+        migrations.RunPython(renumber_duplicates, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='chapter',
+            constraint=models.UniqueConstraint(fields=('story', 'number'), name='unique_story_chapter_number'),
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 3.0.7 on 2026-10-17 19:35
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, models
+from django.db.models import F, Func, OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce, Concat
+from django.contrib.postgres.search import SearchVector
+
+
+def index_stories(apps, schema_editor):
+    Story = apps.get_model('stories', 'Story')
+    Author = apps.get_model('authentication', 'Author')
+    author_name = Author.objects.filter(pk=OuterRef('author')).annotate(name=Concat(
+        Coalesce('nickname', Value('')), Value(' '), 'user__first_name', Value(' '), 'user__last_name',
+        output_field=models.TextField())).values('name')
+    tags = Func(F('tags'), Value(' '), function='array_to_string', output_field=models.TextField())
+    Story.objects.update(search_document=SearchVector('title', Subquery(author_name), weight='A', config='english') +
+                         SearchVector(tags, weight='B', config='english') +
+                         SearchVector('category', weight='C', config='english') +
+                         SearchVector('description', weight='D', config='english'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('authentication', '0003_auto_20210117_1632'),
+        ('stories', '0018_unique_chapter_number'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='story',
+            name='stories_sto_title_5ec1d5_gin',
+        ),
+        migrations.AddField(
+            model_name='story',
+            name='search_document',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='story',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_document'], name='stories_sto_search__d918ec_gin'),
+        ),
+        migrations.RunPython(index_stories, migrations.RunPython.noop),
+    ]
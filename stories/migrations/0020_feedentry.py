@@ -0,0 +1,46 @@
+# Generated by Django 3.0.7 on 2026-10-17 19:43
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feeds(apps, schema_editor):
+    Author = apps.get_model('authentication', 'Author')
+    Story = apps.get_model('stories', 'Story')
+    FeedEntry = apps.get_model('stories', 'FeedEntry')
+    follows = Author.followers.through.objects.values_list('user_id', 'author_id')
+    for user_id, author_id in follows.iterator():
+        stories = Story.objects.filter(author_id=author_id).values_list('pk', 'created')
+        FeedEntry.objects.bulk_create([FeedEntry(user_id=user_id, story_id=story_id, created=created)
+                                       for story_id, created in stories], batch_size=1000, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('authentication', '0003_auto_20210117_1632'),
+        ('stories', '0019_story_search_document'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField()),
+                ('story', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='stories.Story')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['user', '-created'], name='stories_fee_user_id_bb7ca0_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('user', 'story'), name='unique_feed_story'),
+        ),
+        migrations.RunPython(fill_feeds, migrations.RunPython.noop),
+    ]
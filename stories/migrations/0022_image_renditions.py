@@ -0,0 +1,19 @@
+# Generated by Django 3.0.7 on 2026-10-17 20:11
+
+import django.contrib.postgres.fields.jsonb
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('stories', '0021_updated_timestamps'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='story',
+            name='cover_renditions',
+            field=django.contrib.postgres.fields.jsonb.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
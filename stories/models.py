@@ -1,38 +1,61 @@
 from django.db import models
 from .defaults import story_categories
 from authentication.models import Author, User
-from django.db.models.signals import post_save
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_save, post_delete, pre_delete
+from django.db.transaction import atomic
 from django.dispatch import receiver
-from django.contrib.postgres.fields import ArrayField
-from .managers import StoryManager
+from django.contrib.postgres.fields import ArrayField, JSONField
+from .caching import bump
+from jobs.queue import job
+from goldenPensAPI.images import store_renditions
+from django.utils import timezone
+from .managers import StoryManager, ChapterManager, ChapterViewManager, FeedEntryManager, search_document
+from django.contrib.postgres.search import SearchVectorField
 import os
+import uuid
 from django.contrib.postgres.indexes import GinIndex
 
 
 def get_path(instance, filename, *args):
+    # Not named after the story's id, so that the cover can be stored before the story's row is inserted
     path = 'Story Covers'
-    name = f'{instance.id}_story_cover.{filename.split(".")[1]}'
+    name = f'{uuid.uuid4().hex}_story_cover{os.path.splitext(filename)[1].lower()}'
     return os.path.join(path, name)
 
 
-class Story(models.Model):
+class StatsCounters(models.Model):
+    view_count = models.IntegerField(default=0, editable=False)
+    love_count = models.IntegerField(default=0, editable=False)
+    reply_count = models.IntegerField(default=0, editable=False)
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        # The counters are only changed through F() updates, saving an existing row must not write back a stale copy
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [field.name for field in self._meta.concrete_fields if not field.primary_key
+                                       and field.name not in ['view_count', 'love_count', 'reply_count']]
+        super(StatsCounters, self).save(*args, **kwargs)
+
+
+class Story(StatsCounters):
     author = models.ForeignKey(Author, related_name='stories', on_delete=models.CASCADE)
     title = models.CharField(max_length=100)
     description = models.TextField(default='')
     tags = ArrayField(models.CharField(max_length=1500, blank=True), size=30, default=list)
     category = models.CharField(max_length=500, choices=story_categories)
     cover = models.ImageField(upload_to=get_path)
+    cover_renditions = JSONField(default=dict, blank=True, editable=False)
     finished = models.BooleanField(default=False)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+    search_document = SearchVectorField(null=True, editable=False)
 
     def save(self, *args, **kwargs):
-        if self.id is None:
-            image = self.cover
-            self.cover = None
-            super(Story, self).save(*args, **kwargs)
-            self.cover = image
-            if 'force_insert' in kwargs:
-                kwargs.pop('force_insert')
+        # Written along with the rest of the row, a new story takes a single INSERT
+        self.search_document = search_document(self)
         super(Story, self).save(*args, **kwargs)
 
     # Managers
@@ -41,63 +64,99 @@ class Story(models.Model):
 
     class Meta:
         verbose_name_plural = 'stories'
-        indexes = [GinIndex(fields=['title', 'category', 'tags'])]
+        indexes = [GinIndex(fields=['search_document'])]
 
     def __str__(self):
         return self.title
 
     def get_stats(self):
-        stats = {
-            'views': 0,
-            'loves': 0,
-            'replies': 0
+        return {
+            'views': self.view_count,
+            'loves': self.love_count,
+            'replies': self.reply_count
         }
 
-        for chapter in self.chapters.all():
-            stats['views'] += len(chapter.views)
-            stats['loves'] += chapter.loves.count()
-            stats['replies'] += chapter.replies.count()
-
-        return stats
 
-
-class Chapter(models.Model):
+class Chapter(StatsCounters):
     story = models.ForeignKey(Story, related_name='chapters', on_delete=models.CASCADE)
     title = models.CharField(max_length=50)
     content = models.TextField()
     number = models.IntegerField(null=True)
     loves = models.ManyToManyField(User, related_name='loves', blank=True)
-    views = ArrayField(models.CharField(max_length=500, blank=True), default=list)
     created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    objects = ChapterManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['story', 'number'], name='unique_story_chapter_number')]
 
     def __str__(self):
         return self.title
 
+    def save(self, *args, **kwargs):
+        if self._state.adding and self.number is None:
+            with atomic():
+                self.number = Chapter.objects.lock_last_number(self.story_id) + 1
+                super(Chapter, self).save(*args, **kwargs)
+        else:
+            super(Chapter, self).save(*args, **kwargs)
+
     def loves_count(self):
-        return self.loves.count()
+        return self.love_count
 
     def views_count(self):
-        return self.views.count()
+        return self.view_count
 
     def next(self):
-        chapter = self.story.chapters.filter(number=self.number+1)
-        if chapter.exists():
-            return chapter[0].pk
+        if hasattr(self, 'next_id'):
+            return self.next_id
+        return Chapter.objects.filter(story_id=self.story_id, number__gt=self.number).order_by('number')\
+            .values_list('pk', flat=True).first()
 
     def prev(self):
-        if self.number != 1:
-            return self.story.chapters.get(number=self.number-1).pk
+        if hasattr(self, 'prev_id'):
+            return self.prev_id
+        return Chapter.objects.filter(story_id=self.story_id, number__lt=self.number).order_by('-number')\
+            .values_list('pk', flat=True).first()
 
 
-@receiver(post_save, sender=Chapter)
-def number_the_chapter(sender, instance, created, **kwargs):
-    if created:
-        chapters = instance.story.chapters.exclude(pk=instance.pk)
-        if chapters.count() == 0:
-            instance.number = 1
-        else:
-            instance.number = chapters.last().number + 1
-        instance.save()
+class ChapterView(models.Model):
+    chapter = models.ForeignKey(Chapter, related_name='views', on_delete=models.CASCADE)
+    viewer = models.CharField(max_length=500)
+    created = models.DateTimeField(auto_now_add=True)
+
+    objects = ChapterViewManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['chapter', 'viewer'], name='unique_chapter_viewer')]
+
+    def __str__(self):
+        return f'{self.chapter_id} - {self.viewer}'
+
+
+class TrendingSnapshot(models.Model):
+    story = models.OneToOneField(Story, related_name='trending', primary_key=True, on_delete=models.CASCADE)
+    score = models.FloatField(db_index=True)
+    computed = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'{self.story_id} - {self.score}'
+
+
+class FeedEntry(models.Model):
+    user = models.ForeignKey(User, related_name='feed', on_delete=models.CASCADE)
+    story = models.ForeignKey(Story, related_name='feed_entries', on_delete=models.CASCADE)
+    created = models.DateTimeField()
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'story'], name='unique_feed_story')]
+        indexes = [models.Index(fields=['user', '-created'])]
+
+    def __str__(self):
+        return f'{self.user_id} - {self.story_id}'
 
 
 class Reply(models.Model):
@@ -107,6 +166,134 @@ class Reply(models.Model):
     created = models.DateTimeField(auto_now_add=True)
 
 
+def bump_stat(chapter_id, field, delta):
+    # Keeps the chapter counter and its story total in step
+    with atomic():
+        Chapter.objects.filter(pk=chapter_id).update(**{field: F(field) + delta})
+        Story.objects.filter(chapters__pk=chapter_id).update(**{field: F(field) + delta})
+
+
+@receiver(m2m_changed, sender=Chapter.loves.through)
+def count_loves(sender, instance, action, reverse, pk_set, **kwargs):
+    if action == 'post_add' and pk_set:
+        # Only the pks actually added are sent
+        if reverse:
+            for chapter_id in pk_set:
+                bump_stat(chapter_id, 'love_count', 1)
+        else:
+            bump_stat(instance.pk, 'love_count', len(pk_set))
+    elif action == 'post_remove' and pk_set:
+        # Every pk asked for is sent, loves that didn't exist or that a concurrent request removed included
+        Chapter.objects.recount_and_roll_up(reverse and pk_set or [instance.pk], ['love_count'])
+    elif action == 'pre_clear':
+        if reverse:
+            for chapter_id in instance.loves.values_list('pk', flat=True):
+                bump_stat(chapter_id, 'love_count', -1)
+        else:
+            bump_stat(instance.pk, 'love_count', -instance.loves.count())
+
+
+@receiver(post_save, sender=Reply)
+def count_new_reply(sender, instance, created, **kwargs):
+    if created:
+        bump_stat(instance.chapter_id, 'reply_count', 1)
+
+
+@receiver(pre_delete, sender=User)
+def collect_user_stats(sender, instance, **kwargs):
+    # The user's loves and replies go by cascade, which sends no signal for them
+    instance._counted_chapters = set(Chapter.loves.through.objects.filter(user=instance).values_list(
+        'chapter', flat=True).union(Reply.objects.filter(user=instance).values_list('chapter', flat=True)))
+
+
+@receiver(post_delete, sender=User)
+def recount_user_stats(sender, instance, **kwargs):
+    chapters = getattr(instance, '_counted_chapters', None)
+    if chapters:
+        Chapter.objects.recount_and_roll_up(chapters, ['love_count', 'reply_count'])
+
+
+@receiver(post_save, sender=Story)
+def fan_out_story(sender, instance, created, **kwargs):
+    # An author may have many followers, whose feeds are filled in off the request
+    if created:
+        fill_feeds.delay(instance.pk)
+
+
+@receiver(m2m_changed, sender=Author.followers.through)
+def sync_feeds(sender, instance, action, reverse, pk_set, **kwargs):
+    # Following backfills the reader's feed with the author's stories, unfollowing takes them out again
+    if action in ['post_add', 'post_remove'] and pk_set:
+        update = action == 'post_add' and FeedEntry.objects.follow or FeedEntry.objects.unfollow
+        for pk in pk_set:
+            if reverse:
+                update(instance.pk, pk)
+            else:
+                update(pk, instance.pk)
+    elif action == 'pre_clear':
+        if reverse:
+            FeedEntry.objects.filter(user=instance).delete()
+        else:
+            FeedEntry.objects.filter(story__author=instance).delete()
+    if action in ['post_add', 'post_remove', 'post_clear']:
+        # Follower counts are shown on the author's profile and stories
+        authors = reverse and (pk_set or []) or [instance.pk]
+        bump(*[f'author:{pk}' for pk in authors])
+
+
+@job
+def fill_feeds(story_pk):
+    story = Story.objects.filter(pk=story_pk).first()
+    if story is not None:
+        FeedEntry.objects.fan_out(story)
+
+
+@job
+def index_author_stories(author_pk):
+    Story.advanced.index_search(author__pk=author_pk)
+
+
+@job
+def build_cover_renditions(story_pk):
+    story = store_renditions(Story, story_pk, 'cover', updated=timezone.now())
+    if story is not None:
+        bump(f'story:{story_pk}', f'author:{story.author_id}', 'stories')
+
+
+@receiver(post_save, sender=Author)
+def reindex_author_stories(sender, instance, created, **kwargs):
+    # The author's name is part of the search document of their stories, which may be many to rewrite
+    if not created:
+        index_author_stories.delay(instance.pk)
+
+
+@receiver(post_save, sender=Story)
+@receiver(post_delete, sender=Story)
+def expire_story_responses(sender, instance, **kwargs):
+    bump(f'story:{instance.pk}', f'author:{instance.author_id}', 'stories')
+
+
+# Chapter and reply deletes are expired, and counted, by their views: a post_delete receiver would make every
+# cascading delete load the rows it removes
+@receiver(post_save, sender=Chapter)
+def expire_chapter_responses(sender, instance, **kwargs):
+    bump(f'chapter:{instance.pk}', f'story:{instance.story_id}')
+
+
+@receiver(post_save, sender=Reply)
+def expire_reply_responses(sender, instance, **kwargs):
+    # The story's reply total is shown on its overview
+    bump(f'chapter:{instance.chapter_id}', f'story:{instance.chapter.story_id}')
+
+
+@receiver(post_save, sender=Author)
+@receiver(post_delete, sender=Author)
+@receiver(post_save, sender=User)
+def expire_author_responses(sender, instance, **kwargs):
+    # Authors share their user's pk, whose name and pictures are shown alongside
+    bump(f'author:{instance.pk}')
+
+
 class Report(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='reports')
     story = models.ForeignKey(Story, on_delete=models.CASCADE, related_name='reports')
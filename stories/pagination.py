@@ -1,21 +1,163 @@
-from rest_framework.pagination import PageNumberPagination
+from rest_framework.pagination import PageNumberPagination, BasePagination
+from rest_framework.exceptions import NotFound
 from rest_framework.response import Response
+from django.core import signing
+from django.core.cache import cache
+from django.core.paginator import Paginator, PageNotAnInteger, EmptyPage
+from django.conf import settings
+from django.db import connection
+from django.db.models import F, Q
+from django.utils.functional import cached_property
+import datetime
+import hashlib
+import json
 
 
-class RepliesPaginator(PageNumberPagination):
+class KeysetPaginationMixin:
+    """Opt-in cursor pagination, used when the request carries the cursor query param (empty for the first page).
+
+    Pages are sliced on the queryset's ordering plus the primary key as a tie-breaker, so every page is an index
+    range scan from the last row of the previous one instead of a growing OFFSET, and no COUNT(*) is run.
+    """
+
+    cursor_query_param = 'cursor'
+    cursor_salt = 'stories.pagination'
+    cursor = None
+    keyset = False
+
+    def cursor_requested(self, request):
+        return self.cursor_query_param in request.query_params
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.cursor_requested(request):
+            return super().paginate_queryset(queryset, request, view)
+
+        ordering = [key for key in queryset.query.order_by if key.lstrip('-') not in ['id', 'pk']]
+        ordering.append(ordering and ordering[0].startswith('-') and '-id' or 'id')
+        fields = [key.lstrip('-') for key in ordering]
+        queryset = queryset.annotate(**{f'cursor_{i}': F(field) for i, field in enumerate(fields)})
+
+        position = request.query_params[self.cursor_query_param]
+        if position:
+            values = self.decode_cursor(position, len(fields))
+            after = None
+            for i in reversed(range(len(fields))):
+                lookup = ordering[i].startswith('-') and 'lt' or 'gt'
+                step = Q(**{f'cursor_{i}__{lookup}': values[i]})
+                after = step if after is None else step | (Q(**{f'cursor_{i}': values[i]}) & after)
+            queryset = queryset.filter(after)
+
+        page = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        self.cursor = None
+        if len(page) > self.page_size:
+            page = page[:self.page_size]
+            self.cursor = self.encode_cursor([getattr(page[-1], f'cursor_{i}') for i in range(len(fields))])
+        self.keyset = True
+        return page
+
+    def get_paginated_response(self, data):
+        if self.keyset:
+            return Response({
+                'results': data,
+                'next': self.cursor
+            })
+        return super().get_paginated_response(data)
+
+    def encode_cursor(self, values):
+        values = [isinstance(value, datetime.datetime) and value.isoformat() or value for value in values]
+        return signing.dumps(values, salt=self.cursor_salt, compress=True)
+
+    def decode_cursor(self, position, length):
+        try:
+            values = signing.loads(position, salt=self.cursor_salt)
+        except signing.BadSignature:
+            raise NotFound('Invalid cursor')
+        if not isinstance(values, list) or len(values) != length:
+            raise NotFound('Invalid cursor')
+        return values
+
+
+class EstimatedCountPaginator(Paginator):
+    """Paginator whose total is cached per query and estimated by the planner for large result sets.
+
+    The count of a filter set is kept for STORIES_COUNT_CACHE_TIMEOUT seconds, so paging through it counts once.
+    When EXPLAIN expects more than STORIES_COUNT_ESTIMATE_THRESHOLD rows the estimate is used instead of COUNT(*).
+    """
+
+    @cached_property
+    def counted(self):
+        queryset = self.object_list.order_by()
+        sql, params = queryset.query.sql_with_params()
+        key = 'stories:count:' + hashlib.md5(f'{sql}{params}'.encode()).hexdigest()
+        counted = cache.get(key)
+        if counted is None:
+            estimate = self.estimate(sql, params)
+            if estimate > settings.STORIES_COUNT_ESTIMATE_THRESHOLD:
+                counted = (estimate, False)
+            else:
+                counted = (queryset.count(), True)
+            cache.set(key, counted, settings.STORIES_COUNT_CACHE_TIMEOUT)
+        return counted
+
+    @cached_property
+    def count(self):
+        return self.counted[0]
+
+    @property
+    def exact(self):
+        return self.counted[1]
+
+    def page(self, number):
+        if self.exact:
+            return super().page(number)
+        # An estimated total may fall short of the real one, so pages past it are fetched rather than refused
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            raise PageNotAnInteger('That page number is not an integer')
+        if number < 1:
+            raise EmptyPage('That page number is less than 1')
+        bottom = (number - 1) * self.per_page
+        return self._get_page(self.object_list[bottom:bottom + self.per_page], number, self)
+
+    @staticmethod
+    def estimate(sql, params):
+        with connection.cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return plan[0]['Plan']['Plan Rows']
+
+
+class RepliesPaginator(KeysetPaginationMixin, PageNumberPagination):
 
     page_size = 6
     page_query_param = 'p'
 
 
-class StoriesPaginator(PageNumberPagination):
+class StoriesPaginator(KeysetPaginationMixin, PageNumberPagination):
 
     page_query_param = 'page'
     page_size = 9
+    django_paginator_class = EstimatedCountPaginator
 
     def get_paginated_response(self, data):
+        if self.keyset:
+            return super().get_paginated_response(data)
         return Response({
             'results': data,
-            'total': self.page.paginator.num_pages
+            'total': self.page.paginator.num_pages,
+            'exact': self.page.paginator.exact
         })
 
+
+class FollowingPaginator(KeysetPaginationMixin, BasePagination):
+
+    page_size = 10
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Without a cursor the feed keeps returning its latest stories unpaginated
+        if not self.cursor_requested(request):
+            return None
+        return super().paginate_queryset(queryset, request, view)
@@ -1,14 +1,19 @@
 from rest_framework.serializers import ModelSerializer, ReadOnlyField
-from .models import Story, Chapter, Report, Reply
+from .models import Story, Chapter, Report, Reply, build_cover_renditions
+from .managers import search_document
+from .caching import bump
+from django.utils import timezone
 from authentication.models import User, Author
+from goldenPensAPI.images import RenditionsField
 
 
 class UserSerializer(ModelSerializer):
 
     fullname = ReadOnlyField()
+    picture_renditions = RenditionsField('picture')
 
     class Meta:
-        fields = ['pk', 'fullname', 'picture', 'social_picture']
+        fields = ['pk', 'fullname', 'picture', 'picture_renditions', 'social_picture']
         model = User
 
 
@@ -24,9 +29,10 @@ class AuthorSimpleSerializer(ModelSerializer):
 class StoryAdvSerializer(ModelSerializer):
 
     author = AuthorSimpleSerializer()
+    cover_renditions = RenditionsField('cover')
 
     class Meta:
-        fields = ['id', 'cover', 'title', 'created', 'author']
+        fields = ['id', 'cover', 'cover_renditions', 'title', 'created', 'author']
         model = Story
 
 
@@ -60,28 +66,40 @@ class StorySerializer(ModelSerializer):
 
     author = AuthorSerializer()
     get_stats = ReadOnlyField()
+    cover_renditions = RenditionsField('cover')
 
     class Meta:
-        fields = '__all__'
+        exclude = ['search_document']
         model = Story
 
 
 class StoryCreateSerializer(ModelSerializer):
 
     class Meta:
-        fields = '__all__'
+        exclude = ['search_document', 'cover_renditions']
         model = Story
 
     def update(self, instance, validated_data):
         tags = validated_data.pop('tags')
         tags = tags[0].split(',')
-        Story.objects.filter(pk=instance.pk).update(**validated_data, tags=tags)
+        cover = validated_data.pop('cover', None)
+        if cover is not None:
+            # A queryset update doesn't upload files, the new cover is stored first and its renditions rebuilt
+            instance.cover.save(cover.name, cover, save=False)
+            validated_data.update(cover=instance.cover.name, cover_renditions={})
+        Story.objects.filter(pk=instance.pk).update(**validated_data, tags=tags, updated=timezone.now(),
+                                                    search_document=search_document())
+        # Sends no post_save, so the cached responses are expired here
+        bump(f'story:{instance.pk}', f'author:{instance.author_id}', 'stories')
+        if cover is not None:
+            build_cover_renditions.delay(instance.pk)
         return instance
 
     def create(self, validated_data):
         tags = validated_data.pop('tags')
         tags = tags[0].split(',')
         story = Story.objects.create(**validated_data, tags=tags)
+        build_cover_renditions.delay(story.pk)
         return story
 
 
@@ -89,6 +107,15 @@ class ChapterCreateSerializer(ModelSerializer):
 
     class Meta:
         fields = '__all__'
+        # Allocated by Chapter.save under the story's lock, never taken from the client
+        read_only_fields = ['number']
+        model = Chapter
+
+
+class ChapterBulkSerializer(ModelSerializer):
+
+    class Meta:
+        fields = ['title', 'content']
         model = Chapter
 
 
@@ -100,7 +127,7 @@ class ChapterSerializer(ModelSerializer):
     loves = ReadOnlyField(source='loves_count')
 
     class Meta:
-        exclude = ['views']
+        fields = '__all__'
         model = Chapter
 
 
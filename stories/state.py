@@ -0,0 +1,32 @@
+from django.conf import settings
+from django.core.cache import cache
+from authentication.models import Author
+from .models import Chapter
+
+
+def followed_authors(user_pk):
+    """Ids of every author the user follows, cached per user until update_follow changes them."""
+    key = f'state:follows:{user_pk}'
+    followed = cache.get(key)
+    if followed is None:
+        followed = set(Author.followers.through.objects.filter(user__pk=user_pk).values_list('author', flat=True))
+        cache.set(key, followed, settings.VIEWER_STATE_CACHE_TIMEOUT)
+    return followed
+
+
+def loved_chapters(user_pk):
+    """Ids of every chapter the user loved, cached per user until update_chapter_love changes them."""
+    key = f'state:loves:{user_pk}'
+    loved = cache.get(key)
+    if loved is None:
+        loved = set(Chapter.loves.through.objects.filter(user__pk=user_pk).values_list('chapter', flat=True))
+        cache.set(key, loved, settings.VIEWER_STATE_CACHE_TIMEOUT)
+    return loved
+
+
+def forget_follows(user_pk):
+    cache.delete(f'state:follows:{user_pk}')
+
+
+def forget_loves(user_pk):
+    cache.delete(f'state:loves:{user_pk}')
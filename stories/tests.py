@@ -1,15 +1,38 @@
 from rest_framework.test import APITestCase
 from django.shortcuts import reverse
-from .models import Story, Report, Chapter, Reply
-from .utils import get_auth_user, create_test_story, create_test_chapter, create_adv_test_story
+from .models import Story, Report, Chapter, Reply, ChapterView, FeedEntry, build_cover_renditions
+from .utils import get_auth_user, create_test_story, create_test_chapter, create_adv_test_story, seed_fan_out, \
+    QueryBudgetMixin
 from authentication.models import User
+from authentication.tokens import revocations
 from django.core.files.uploadedfile import SimpleUploadedFile
 from django.utils import timezone
+from django.test import override_settings
+from django.core.management import call_command
+from django.core.cache import cache
+from goldenPensAPI.cache import SQLiteCache
+from .caching import coalesced, single_flight, bump
+import threading
+import tempfile
+import os
+from .buffers import view_buffer
+from jobs.queue import run_pending
+from goldenPensAPI.images import render
+from django.conf import settings
+from django.core.files.storage import default_storage
+from PIL import Image
+import io
 import datetime
+import time
+from io import StringIO
 
 
 class StoryTest(APITestCase):
 
+    def setUp(self):
+        # Story list totals are cached per query
+        cache.clear()
+
     def test_creates_story(self):
         user = get_auth_user()
         self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
@@ -36,6 +59,76 @@ class StoryTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['id'], story.pk)
 
+    def test_retrieves_story_overview_in_one_query(self):
+        story = create_test_story()
+        for _ in range(5):
+            create_test_chapter(story)
+        follower = get_auth_user(email='follower@ex.com')
+        story.author.followers.add(follower, get_auth_user(email='other@ex.com'))
+        url = reverse('stories:story_overview', args=[story.pk])
+        # The ETag hashes the overview the view sends, built by one query after looking up what it depends on
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.data['author']['followers'], 2)
+        self.assertNotIn('inFollowers', response.data['author'])
+        # The cached overview is shared, only the follow state is looked up for the user
+        with self.assertNumQueries(1):
+            response = self.client.get(f'{url}?user={follower.pk}')
+        self.assertTrue(response.data['author']['inFollowers'])
+        with self.assertNumQueries(0):
+            self.client.get(f'{url}?user={follower.pk}')
+
+    def test_expires_cached_story_overview_on_update(self):
+        story = create_test_story()
+        url = reverse('stories:story_overview', args=[story.pk])
+        etag = self.client.get(url)['ETag']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        data = {'title': 'Changed', 'tags': ['tag']}
+        response = self.client.put(reverse('stories:story_create', args=[story.pk]), data, format='json')
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['title'], 'Changed')
+
+    def test_expires_cached_story_stats_on_replies(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        user = story.author.user
+        url = reverse('stories:story_overview', args=[story.pk])
+        self.assertEqual(self.client.get(url).data['get_stats']['replies'], 0)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        data = {'user': user.pk, 'chapter': chapter.pk, 'content': 'Reply'}
+        reply = self.client.post(reverse('stories:reply_create'), data, format='json').data
+        self.assertEqual(self.client.get(url).data['get_stats']['replies'], 1)
+        self.client.delete(reverse('stories:reply_update', args=[reply['id']]))
+        self.assertEqual(self.client.get(url).data['get_stats']['replies'], 0)
+
+    def test_answers_unchanged_story_with_304(self):
+        story = create_test_story()
+        follower = get_auth_user(email='follower@ex.com')
+        url = f"{reverse('stories:story_overview', args=[story.pk])}?user={follower.pk}"
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {follower.token()}')
+        self.client.post(reverse('stories:update_follow'), {'user': follower.pk, 'author': story.author.pk},
+                         format='json')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.data['author']['inFollowers'])
+
+    def test_expires_cached_story_overview(self):
+        story = create_test_story()
+        url = reverse('stories:story_overview', args=[story.pk])
+        self.client.get(url)
+        story.title = 'Changed'
+        story.save()
+        self.assertEqual(self.client.get(url).data['title'], 'Changed')
+        story.author.nickname = 'Johnny'
+        story.author.save()
+        self.assertEqual(self.client.get(url).data['author']['nickname'], 'Johnny')
+        story.author.followers.add(get_auth_user(email='follower@ex.com'))
+        self.assertEqual(self.client.get(url).data['author']['followers'], 1)
+
     def test_updates_story(self):
         story = create_test_story()
         self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
@@ -93,8 +186,8 @@ class StoryTest(APITestCase):
         create_adv_test_story({'title': 'Story1', 'category': 'quest'})
         trend_story = create_adv_test_story({'title': 'Story2', 'category': 'quest'}, email='Ex@ex.com')
         chapter = create_test_chapter(trend_story)
-        chapter.views.append('127.0.0.1')
-        chapter.save()
+        ChapterView.objects.record(chapter.pk, '127.0.0.1')
+        call_command('compute_trending', stdout=StringIO())
         url = f"{reverse('stories:stories_advanced')}?sort=trending"
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
@@ -109,7 +202,7 @@ class StoryTest(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], story1.title)
 
-    def test_filters_with_title_trigram_correctly(self):
+    def test_filters_with_title_search_correctly(self):
         story1 = create_adv_test_story({'title': 'Romeo and Juliet', 'category': 'rebirth'})
         url = f"{reverse('stories:stories_advanced')}?search=Romeo"
         response = self.client.get(url)
@@ -117,15 +210,15 @@ class StoryTest(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], story1.title)
 
-    def test_filters_with_tags_trigram_correctly(self):
+    def test_filters_with_tags_search_correctly(self):
         story1 = create_adv_test_story({'title': 'Bueaty and The Beast', 'category': 'rebirth', 'tags': ['Romance']})
-        url = f"{reverse('stories:stories_advanced')}?search=Romantic"
+        url = f"{reverse('stories:stories_advanced')}?search=romances"
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], story1.title)
 
-    def test_filters_with_fullname_trigram_correctly(self):
+    def test_filters_with_fullname_search_correctly(self):
         story = create_adv_test_story({'title': 'Story1', 'category': 'quest'})
         url = f"{reverse('stories:stories_advanced')}?search=John"
         response = self.client.get(url)
@@ -133,17 +226,19 @@ class StoryTest(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], story.title)
 
-    def test_filters_with_nickname_trigram_correctly(self):
+    def test_filters_with_nickname_search_correctly(self):
         story = create_adv_test_story({'title': 'Story1', 'category': 'quest'})
         story.author.nickname = 'Mr. Wolfie'
         story.author.save()
+        # Renamed authors have their stories reindexed by a background job
+        run_pending()
         url = f"{reverse('stories:stories_advanced')}?search=wolfie"
         response = self.client.get(url)
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['title'], story.title)
 
-    def test_filters_with_category_trigram_correctly(self):
+    def test_filters_with_category_search_correctly(self):
         story = create_adv_test_story({'title': 'Story1', 'category': 'overcome'})
         url = f"{reverse('stories:stories_advanced')}?search=overcoming"
         response = self.client.get(url)
@@ -162,12 +257,70 @@ class StoryTest(APITestCase):
         self.assertEqual(len(response.data['results']), 1)
         self.assertEqual(response.data['results'][0]['id'], story.id)
 
+    def test_caches_stories_total(self):
+        author = get_auth_user().author
+        for i in range(10):
+            Story.objects.create(title=f'Story{i}', author=author, category='quest')
+        url = f"{reverse('stories:stories_advanced')}?cat=quest"
+        response = self.client.get(url)
+        self.assertEqual(response.data['total'], 2)
+        self.assertTrue(response.data['exact'])
+        Story.objects.create(title='Story10', author=author, category='quest')
+        response = self.client.get(f'{url}&page=2')
+        self.assertEqual(response.data['total'], 2)
+        cache.clear()
+        response = self.client.get(f'{url}&page=2')
+        self.assertEqual(response.data['total'], 2)
+        self.assertEqual(len(response.data['results']), 2)
+
+    @override_settings(STORIES_COUNT_ESTIMATE_THRESHOLD=0)
+    def test_estimates_large_stories_total(self):
+        author = get_auth_user().author
+        for i in range(3):
+            Story.objects.create(title=f'Story{i}', author=author, category='quest')
+        response = self.client.get(reverse('stories:stories_advanced'))
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.data['exact'])
+        self.assertEqual(len(response.data['results']), 3)
+        response = self.client.get(f"{reverse('stories:stories_advanced')}?page=50")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['results'], [])
+
+    def test_pages_stories_with_cursor(self):
+        author = get_auth_user().author
+        stories = [Story.objects.create(title=f'Story{i}', author=author, category='quest') for i in range(11)]
+        url = reverse('stories:stories_advanced')
+        response = self.client.get(f'{url}?sort=-created&cursor=')
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn('total', response.data)
+        first = [story['id'] for story in response.data['results']]
+        response = self.client.get(url, {'sort': '-created', 'cursor': response.data['next']})
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['next'])
+        second = [story['id'] for story in response.data['results']]
+        self.assertEqual(first + second, [story.id for story in reversed(stories)])
+
+    def test_pages_ties_with_cursor(self):
+        author = get_auth_user().author
+        stories = [Story.objects.create(title=f'Story{i}', author=author, category='quest') for i in range(11)]
+        Story.objects.update(view_count=5)
+        url = reverse('stories:stories_advanced')
+        response = self.client.get(f'{url}?sort=mostViewed&cursor=')
+        first = [story['id'] for story in response.data['results']]
+        response = self.client.get(url, {'sort': 'mostViewed', 'cursor': response.data['next']})
+        second = [story['id'] for story in response.data['results']]
+        self.assertEqual(sorted(first + second), [story.id for story in stories])
+
+    def test_rejects_tampered_cursor(self):
+        response = self.client.get(f"{reverse('stories:stories_advanced')}?cursor=forged")
+        self.assertEqual(response.status_code, 404)
+
     def test_fetches_trending_stories(self):
         create_test_story()
         story = create_test_story(email='ex@ex.com')
         chapter = create_test_chapter(story)
-        chapter.views.append('127.0.0.1')
-        chapter.save()
+        ChapterView.objects.record(chapter.pk, '127.0.0.1')
+        call_command('compute_trending', stdout=StringIO())
         response = self.client.get(reverse('stories:trending'))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data), 2)
@@ -178,14 +331,27 @@ class StoryTest(APITestCase):
         story = create_test_story(email='ex@ex.com')
         story.created = timezone.now() - datetime.timedelta(days=8)
         chapter = create_test_chapter(story)
-        chapter.views.append('127.0.0.1')
-        chapter.save()
+        ChapterView.objects.record(chapter.pk, '127.0.0.1')
         story.save()
+        call_command('compute_trending', stdout=StringIO())
         response = self.client.get(reverse('stories:trending'))
         self.assertEqual(response.status_code, 200)
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['title'], story1.title)
 
+    def test_trending_decays_older_views(self):
+        old_story = create_test_story()
+        old_chapter = create_test_chapter(old_story)
+        ChapterView.objects.record(old_chapter.pk, '127.0.0.1')
+        ChapterView.objects.record(old_chapter.pk, '127.0.0.2')
+        old_chapter.views.update(created=timezone.now() - datetime.timedelta(days=3))
+        story = create_test_story(email='ex@ex.com')
+        ChapterView.objects.record(create_test_chapter(story).pk, '127.0.0.1')
+        call_command('compute_trending', stdout=StringIO())
+        response = self.client.get(reverse('stories:trending'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([data['id'] for data in response.data], [story.pk, old_story.pk])
+
     def test_fetches_latest_stories(self):
         create_test_story()
         story = create_test_story(email='ex@ex.com')
@@ -213,6 +379,36 @@ class StoryTest(APITestCase):
         self.assertEqual(len(response.data), 1)
         self.assertEqual(response.data[0]['id'], story.id)
 
+    def test_feeds_stories_published_after_following(self):
+        author = get_auth_user(email='ex@ex.com').author
+        user = get_auth_user(email='my@email.com')
+        author.followers.add(user)
+        story = Story.objects.create(title='New', author=author, category='quest')
+        self.assertFalse(FeedEntry.objects.exists())
+        run_pending()
+        self.assertEqual(FeedEntry.objects.get(user=user).story, story)
+        response = self.client.get(reverse('stories:following', args=[user.pk]))
+        self.assertEqual([story['id'] for story in response.data], [story.id])
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        self.client.post(reverse('stories:update_follow'), {'user': user.pk, 'author': author.pk}, format='json')
+        self.assertFalse(FeedEntry.objects.filter(user=user).exists())
+        response = self.client.get(reverse('stories:following', args=[user.pk]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_pages_following_stories_with_cursor(self):
+        story = create_test_story(email='ex@ex.com')
+        user = get_auth_user(email='my@email.com')
+        story.author.followers.add(user)
+        for i in range(10):
+            Story.objects.create(title=f'Story{i}', author=story.author, category='quest')
+        run_pending()
+        url = reverse('stories:following', args=[user.pk])
+        response = self.client.get(f'{url}?cursor=')
+        self.assertEqual(len(response.data['results']), 10)
+        response = self.client.get(url, {'cursor': response.data['next']})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([story['id'] for story in response.data['results']], [story.id])
+
     def test_fetches_data_for_saving_story(self):
         story = create_test_story()
         create_test_chapter(story)
@@ -261,6 +457,44 @@ class ChapterTest(APITestCase):
         chapter5 = create_test_chapter(story2)
         self.assertEqual(chapter5.number, 1)
 
+    def test_ignores_client_chapter_number(self):
+        story = create_test_story()
+        create_test_chapter(story)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        for number in [1, 7]:
+            data = {'title': 'Ch', 'story': story.pk, 'content': 'Test Chapter', 'number': number}
+            response = self.client.post(reverse('stories:chapter_create'), data, format='json')
+            self.assertEqual(response.status_code, 201)
+        self.assertEqual(list(story.chapters.order_by('number').values_list('number', flat=True)), [1, 2, 3])
+        chapter = story.chapters.get(number=3)
+        response = self.client.put(reverse('stories:chapter_update', args=[chapter.pk]), {'number': 1}, format='json')
+        self.assertEqual(response.status_code, 200)
+        chapter.refresh_from_db()
+        self.assertEqual(chapter.number, 3)
+
+    def test_creates_chapters_in_bulk(self):
+        story = create_test_story()
+        create_test_chapter(story)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        data = {
+            'story': story.pk,
+            'chapters': [{'title': f'Ch{i}', 'content': 'Test Chapter'} for i in range(2, 5)]
+        }
+        response = self.client.post(reverse('stories:chapter_create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.data), 3)
+        chapters = story.chapters.order_by('number')
+        self.assertEqual([chapter.number for chapter in chapters], [1, 2, 3, 4])
+        self.assertEqual([chapter.title for chapter in chapters[1:]], ['Ch2', 'Ch3', 'Ch4'])
+
+    def test_rejects_invalid_bulk_chapters(self):
+        story = create_test_story()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        data = {'story': story.pk, 'chapters': [{'title': 'Ch1', 'content': 'Test Chapter'}, {'title': 'Ch2'}]}
+        response = self.client.post(reverse('stories:chapter_create'), data, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(story.chapters.count(), 0)
+
     def test_retrieves_chapter(self):
         story = create_test_story()
         chapter = create_test_chapter(story)
@@ -268,6 +502,89 @@ class ChapterTest(APITestCase):
         self.assertEqual(response.status_code, 200)
         self.assertEqual(response.data['title'], chapter.title)
 
+    def test_retrieves_chapter_in_one_query(self):
+        cache.clear()
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        for _ in range(5):
+            create_test_chapter(story)
+        user = get_auth_user(email='reader@ex.com')
+        chapter.loves.add(user)
+        story.author.followers.add(user)
+        with self.assertNumQueries(2):
+            self.client.get(reverse('stories:chapter_view', args=[chapter.pk]))
+        with self.assertNumQueries(2):
+            response = self.client.get(f"{reverse('stories:chapter_view', args=[chapter.pk])}?user={user.pk}")
+        self.assertEqual(response.data['loves'], 1)
+        self.assertTrue(response.data['loved'])
+        self.assertTrue(response.data['story']['author']['inFollowers'])
+        self.assertEqual(response.data['story']['author']['followers'], 1)
+        self.assertEqual(response.data['story']['get_stats']['loves'], 1)
+
+    def test_answers_unchanged_chapter_with_304(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        user = get_auth_user(email='reader@ex.com')
+        url = f"{reverse('stories:chapter_view', args=[chapter.pk])}?user={user.pk}"
+        response = self.client.get(url)
+        etag = response['ETag']
+        # Counters and viewers change without touching updated, so it can't validate the chapter
+        self.assertNotIn('Last-Modified', response)
+        with self.assertNumQueries(0):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        # The ETag follows the cached body, which takes the new count in once it is rebuilt
+        ChapterView.objects.record(chapter.pk, '127.0.0.1')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        cache.clear()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['view_count'], 1)
+        etag = response['ETag']
+        chapter.content = 'Edited'
+        chapter.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_expires_chapter_etag_with_neighbours(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        url = reverse('stories:chapter_view', args=[chapter.pk])
+        etag = self.client.get(url)['ETag']
+        following = create_test_chapter(story)
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['next'], following.pk)
+        etag = response['ETag']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        self.client.delete(reverse('stories:chapter_update', args=[following.pk]))
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.data['next'])
+
+    def test_answers_unchanged_chapter_list_with_304(self):
+        story = create_test_story()
+        create_test_chapter(story)
+        url = reverse('stories:chapters_overview', args=[story.pk])
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        save_url = reverse('stories:save_fetch', args=[story.pk])
+        self.assertEqual(self.client.get(save_url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        create_test_chapter(story)
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_retrieves_chapter_neighbours(self):
+        story = create_test_story()
+        first = create_test_chapter(story)
+        second = create_test_chapter(story)
+        third = create_test_chapter(story)
+        response = self.client.get(reverse('stories:chapter_view', args=[second.pk]))
+        self.assertEqual((response.data['prev'], response.data['next']), (first.pk, third.pk))
+        second.delete()
+        response = self.client.get(reverse('stories:chapter_view', args=[first.pk]))
+        self.assertEqual((response.data['prev'], response.data['next']), (None, third.pk))
+        response = self.client.get(reverse('stories:chapter_view', args=[third.pk]))
+        self.assertEqual((response.data['prev'], response.data['next']), (first.pk, None))
+
     def test_saves_chapter(self):
         story = create_test_story()
         self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
@@ -279,14 +596,55 @@ class ChapterTest(APITestCase):
         self.assertEqual(chapter.title, data['title'])
         self.assertEqual(chapter.content, data['content'])
 
+    def test_rejects_saving_chapter_of_another_author(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        other = get_auth_user(email='other@ex.com')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {other.token()}')
+        data = {'title': 'Updated Title', 'content': 'Updated Content'}
+        response = self.client.put(reverse('stories:chapter_update', args=[chapter.pk]), data, format='json')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(Chapter.objects.get(pk=chapter.pk).title, chapter.title)
+
     def test_adds_view(self):
         story = create_test_story()
         chapter = create_test_chapter(story)
-        self.assertEqual(len(chapter.views), 0)
+        self.assertEqual(chapter.views.count(), 0)
+        response = self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(chapter.views.count(), 1)
+        self.assertEqual(chapter.views.first().viewer, '127.0.0.1')
+
+    def test_does_not_duplicate_view(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
         response = self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
-        chapter = Chapter.objects.get(pk=chapter.pk)
         self.assertEqual(response.status_code, 200)
-        self.assertEqual(len(chapter.views), 1)
+        self.assertEqual(chapter.views.count(), 1)
+
+    @override_settings(BUFFER_CHAPTER_VIEWS=True, CHAPTER_VIEWS_BUFFER_SIZE=100, CHAPTER_VIEWS_FLUSH_INTERVAL=3600)
+    def test_buffers_views_until_flushed(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
+        response = self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(chapter.views.count(), 0)
+        self.assertEqual(len(view_buffer), 1)
+        self.assertEqual(view_buffer.flush(), 1)
+        self.assertEqual(len(view_buffer), 0)
+        self.assertEqual(chapter.views.count(), 1)
+
+    @override_settings(BUFFER_CHAPTER_VIEWS=True, CHAPTER_VIEWS_BUFFER_SIZE=2, CHAPTER_VIEWS_FLUSH_INTERVAL=3600)
+    def test_flushes_views_when_buffer_is_full(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
+        self.assertEqual(chapter.views.count(), 0)
+        self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]), REMOTE_ADDR='10.0.0.1')
+        self.assertEqual(len(view_buffer), 0)
+        self.assertEqual(chapter.views.count(), 2)
 
     def test_adds_love(self):
         story = create_test_story()
@@ -315,6 +673,98 @@ class ChapterTest(APITestCase):
         self.assertFalse(chapter.loves.filter(pk=user.pk).exists())
 
 
+class StatsTest(APITestCase):
+
+    def test_counts_views_loves_and_replies(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        user = story.author.user
+        self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
+        self.client.get(reverse('stories:update_chapter_view', args=[chapter.pk]))
+        chapter.loves.add(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        for _ in range(2):
+            data = {'user': user.pk, 'chapter': chapter.pk, 'content': 'Reply'}
+            self.client.post(reverse('stories:reply_create'), data, format='json')
+        chapter = Chapter.objects.get(pk=chapter.pk)
+        self.assertEqual((chapter.view_count, chapter.love_count, chapter.reply_count), (1, 1, 2))
+        story = Story.objects.get(pk=story.pk)
+        self.assertEqual(story.get_stats(), {'views': 1, 'loves': 1, 'replies': 2})
+
+    def test_counts_replies_created_outside_the_api(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        chapter.replies.create(user=story.author.user, content='Reply')
+        self.assertEqual(Chapter.objects.get(pk=chapter.pk).reply_count, 1)
+        self.assertEqual(Story.objects.get(pk=story.pk).get_stats()['replies'], 1)
+
+    def test_decrements_stats(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        user = story.author.user
+        chapter.loves.add(user)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        data = {'user': user.pk, 'chapter': chapter.pk, 'content': 'Reply'}
+        response = self.client.post(reverse('stories:reply_create'), data, format='json')
+        chapter.loves.remove(user)
+        self.client.delete(reverse('stories:reply_update', args=[response.data['id']]))
+        story = Story.objects.get(pk=story.pk)
+        self.assertEqual(story.get_stats(), {'views': 0, 'loves': 0, 'replies': 0})
+
+    def test_ignores_removing_missing_loves(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        lover, other = story.author.user, get_auth_user(email='other@ex.com')
+        chapter.loves.add(lover)
+        chapter.loves.remove(other)
+        self.assertEqual(Chapter.objects.get(pk=chapter.pk).love_count, 1)
+        chapter.loves.remove(lover)
+        chapter.loves.remove(lover)
+        other.loves.remove(chapter)
+        self.assertEqual(Chapter.objects.get(pk=chapter.pk).love_count, 0)
+        self.assertEqual(Story.objects.get(pk=story.pk).get_stats()['loves'], 0)
+
+    def test_recounts_stats_of_deleted_user(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        reader = get_auth_user(email='reader@ex.com')
+        chapter.loves.add(reader, story.author.user)
+        chapter.replies.create(user=reader, content='Reply')
+        reader.delete()
+        self.assertEqual(Story.objects.get(pk=story.pk).get_stats(), {'views': 0, 'loves': 1, 'replies': 0})
+
+    def test_rolls_up_stats_of_deleted_chapter(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        other_chapter = create_test_chapter(story)
+        ChapterView.objects.record(chapter.pk, '127.0.0.1')
+        ChapterView.objects.record(other_chapter.pk, '127.0.0.1')
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        self.client.delete(reverse('stories:chapter_update', args=[chapter.pk]))
+        story = Story.objects.get(pk=story.pk)
+        self.assertEqual(story.get_stats(), {'views': 1, 'loves': 0, 'replies': 0})
+
+    def test_saving_does_not_overwrite_stats(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        ChapterView.objects.record(chapter.pk, '127.0.0.1')
+        chapter.title = 'New Title'
+        chapter.save()
+        story.save()
+        self.assertEqual(Chapter.objects.get(pk=chapter.pk).view_count, 1)
+        self.assertEqual(Story.objects.get(pk=story.pk).view_count, 1)
+
+    def test_recounts_stats(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        chapter.views.create(viewer='127.0.0.1')
+        chapter.views.create(viewer='127.0.0.2')
+        Chapter.loves.through.objects.create(chapter=chapter, user=story.author.user)
+        call_command('recount_stats', stdout=StringIO())
+        self.assertEqual(Chapter.objects.get(pk=chapter.pk).view_count, 2)
+        self.assertEqual(Story.objects.get(pk=story.pk).get_stats(), {'views': 2, 'loves': 1, 'replies': 0})
+
+
 class AuthorTest(APITestCase):
 
     def test_adds_follow(self):
@@ -353,6 +803,44 @@ class AuthorTest(APITestCase):
         self.assertEqual(author.author.followers.count(), 0)
 
 
+class ViewerStateTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_resolves_follows_and_loves(self):
+        story = create_test_story()
+        other = create_test_story(email='ex@ex.com')
+        chapter = create_test_chapter(story)
+        other_chapter = create_test_chapter(other)
+        user = get_auth_user(email='my@email.com')
+        story.author.followers.add(user)
+        chapter.loves.add(user)
+        url = reverse('stories:viewer_state')
+        response = self.client.get(url, {'user': user.pk, 'authors': f'{story.author.pk},{other.author.pk}',
+                                         'chapters': f'{chapter.pk},{other_chapter.pk}'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'following': [story.author.pk], 'loved': [chapter.pk]})
+
+    def test_refreshes_after_follow_and_love(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        user = get_auth_user(email='my@email.com')
+        url = reverse('stories:viewer_state')
+        params = {'user': user.pk, 'authors': story.author.pk, 'chapters': chapter.pk}
+        self.assertEqual(self.client.get(url, params).data, {'following': [], 'loved': []})
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        self.client.post(reverse('stories:update_follow'), {'user': user.pk, 'author': story.author.pk},
+                         format='json')
+        self.client.post(reverse('stories:update_chapter_love', args=[chapter.pk]), {'user': user.pk},
+                         format='json')
+        self.assertEqual(self.client.get(url, params).data, {'following': [story.author.pk], 'loved': [chapter.pk]})
+
+    def test_rejects_malformed_ids(self):
+        response = self.client.get(reverse('stories:viewer_state'), {'user': 1, 'authors': '1,a'})
+        self.assertEqual(response.status_code, 400)
+
+
 class ReplyTest(APITestCase):
 
     def test_fetch_replies(self):
@@ -365,6 +853,18 @@ class ReplyTest(APITestCase):
         self.assertEqual(len(results), 1)
         self.assertEqual(results[0]['content'], 'New Reply')
 
+    def test_pages_replies_with_cursor(self):
+        story = create_test_story()
+        chapter = create_test_chapter(story)
+        for i in range(7):
+            chapter.replies.create(user=story.author.user, content=f'Reply{i}')
+        url = reverse('stories:reply_view', args=[chapter.pk])
+        response = self.client.get(f'{url}?cursor=')
+        self.assertEqual(len(response.data['results']), 6)
+        response = self.client.get(url, {'cursor': response.data['next']})
+        self.assertEqual([reply['content'] for reply in response.data['results']], ['Reply0'])
+        self.assertIsNone(response.data['next'])
+
     def test_creates_reply(self):
         story = create_test_story()
         chapter = create_test_chapter(story)
@@ -400,3 +900,395 @@ class ReplyTest(APITestCase):
         self.assertEqual(response.status_code, 204)
         self.assertEqual(Reply.objects.count(), 0)
 
+
+class SQLiteCacheTest(APITestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.cache = SQLiteCache(os.path.join(self.directory.name, 'cache.sqlite3'),
+                                 {'OPTIONS': {'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2, 'CULL_EVERY': 1,
+                                              'LRU_RESOLUTION': 0}})
+
+    def test_stores_and_expires_entries(self):
+        self.cache.set('story', {'title': 'Title'})
+        self.assertEqual(self.cache.get('story'), {'title': 'Title'})
+        self.assertFalse(self.cache.add('story', 'other'))
+        self.cache.set('expired', 1, timeout=0)
+        self.assertIsNone(self.cache.get('expired'))
+        self.assertTrue(self.cache.add('expired', 2))
+        self.assertEqual(self.cache.get_many(['story', 'expired', 'missing']), {'story': {'title': 'Title'},
+                                                                               'expired': 2})
+        self.cache.delete('story')
+        self.assertIsNone(self.cache.get('story'))
+
+    def test_increments_in_place(self):
+        self.cache.set('version', 1)
+        self.assertEqual(self.cache.incr('version'), 2)
+        self.assertEqual(self.cache.get('version'), 2)
+        with self.assertRaises(ValueError):
+            self.cache.incr('missing')
+
+    def test_evicts_least_recently_used(self):
+        for key in 'abcd':
+            self.cache.set(key, key)
+            time.sleep(0.01)
+        self.cache.get('a')
+        self.cache.set('e', 'e')
+        self.assertEqual(sorted(self.cache.get_many(list('abcde'))), ['a', 'd', 'e'])
+
+    def test_counts_entries_every_few_writes(self):
+        cache = SQLiteCache(self.cache._path, {'OPTIONS': {'MAX_ENTRIES': 4, 'CULL_FREQUENCY': 2, 'CULL_EVERY': 3}})
+        for key in 'abcde':
+            cache.set(key, key)
+        self.assertEqual(len(cache.get_many(list('abcdef'))), 5)
+        cache.set('f', 'f')
+        self.assertEqual(len(cache.get_many(list('abcdef'))), 3)
+
+    def test_is_shared_between_instances(self):
+        other = SQLiteCache(self.cache._path, {})
+        self.cache.set('story', 1)
+        self.assertEqual(other.get('story'), 1)
+        other.incr('story')
+        self.assertEqual(self.cache.get('story'), 2)
+
+
+class SingleFlightTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def test_rebuilds_once_for_concurrent_misses(self):
+        builds = []
+
+        def build():
+            builds.append(1)
+            time.sleep(0.2)
+            return 'data'
+
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(coalesced('hot', build, []))) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(builds), 1)
+        self.assertEqual(results, ['data'] * 5)
+
+    def test_serves_stale_data_while_rebuilding(self):
+        coalesced('hot', lambda: 'old', ['stories'])
+        bump('stories')
+        cache.add('lock:hot', True)
+        self.assertEqual(coalesced('hot', lambda: 'new', ['stories']), 'old')
+        cache.delete('lock:hot')
+        self.assertEqual(coalesced('hot', lambda: 'new', ['stories']), 'new')
+
+    def test_bump_during_rebuild_leaves_entry_stale(self):
+        def build():
+            bump('stories')
+            return 'old'
+
+        self.assertEqual(coalesced('hot', build, ['stories']), 'old')
+        self.assertEqual(coalesced('hot', lambda: 'new', ['stories']), 'new')
+
+    def test_caches_querysets_of_decorated_functions(self):
+        create_test_story()
+
+        @single_flight('stories:{limit}', ['stories'])
+        def latest(limit=None):
+            return Story.objects.order_by('-created')[:limit]
+
+        self.assertEqual(len(latest(limit=5)), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(latest(limit=5)), 1)
+        create_test_story(email='ex@ex.com')
+        self.assertEqual(len(latest(limit=5)), 2)
+
+
+class RenditionsTest(APITestCase):
+
+    def setUp(self):
+        cache.clear()
+
+    def upload(self, name='cover.png'):
+        with open('stories/testImage.png', 'rb') as image:
+            return SimpleUploadedFile(name, image.read(), 'image/png')
+
+    def assertRenditions(self, renditions):
+        self.assertEqual(set(renditions), set(settings.IMAGE_RENDITIONS))
+        for name, path in renditions.items():
+            with default_storage.open(path) as stored:
+                image = Image.open(stored)
+                self.assertEqual(image.format, settings.IMAGE_RENDITION_FORMAT)
+                width, height = settings.IMAGE_RENDITIONS[name]
+                self.assertTrue(image.width <= width and image.height <= height)
+
+    def test_builds_cover_renditions(self):
+        user = get_auth_user()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        data = {'title': 'Title', 'category': 'quest', 'cover': self.upload(), 'author': user.pk, 'tags': ['']}
+        pk = self.client.post(reverse('stories:story_create'), data).data['id']
+        url = reverse('stories:stories_advanced')
+        # The original stands in until the renditions are built
+        story = self.client.get(url).data['results'][0]
+        self.assertEqual(set(story['cover_renditions'].values()), {story['cover']})
+        # Its renditions and its author's followers' feeds
+        self.assertEqual(run_pending(), (2, 0))
+        self.assertRenditions(Story.objects.get(pk=pk).cover_renditions)
+        story = self.client.get(url).data['results'][0]
+        self.assertNotIn(story['cover'], story['cover_renditions'].values())
+        self.assertTrue(story['cover_renditions']['card'].endswith('_card.webp'))
+
+    def test_replacing_cover_rebuilds_renditions(self):
+        story = create_test_story()
+        build_cover_renditions(story.pk)
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {story.author.user.token()}')
+        data = {'cover': self.upload('new.png'), 'tags': ['']}
+        response = self.client.put(reverse('stories:story_create', args=[story.pk]), data)
+        self.assertEqual(response.status_code, 200)
+        replaced = Story.objects.get(pk=story.pk)
+        self.assertNotEqual(replaced.cover.name, story.cover.name)
+        self.assertTrue(default_storage.exists(replaced.cover.name))
+        self.assertEqual(replaced.cover_renditions, {})
+        run_pending()
+        self.assertRenditions(Story.objects.get(pk=story.pk).cover_renditions)
+
+    def test_builds_profile_renditions(self):
+        user = get_auth_user()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {user.token()}')
+        self.client.post(reverse('authentication:update_media'), {'picture': self.upload('picture.png'),
+                                                                  'user': user.pk})
+        self.assertEqual(run_pending(), (1, 0))
+        user = User.objects.get(pk=user.pk)
+        self.assertRenditions(user.picture_renditions)
+        self.assertEqual(user.cover_renditions, {})
+
+    def test_queues_missing_renditions(self):
+        story = create_test_story()
+        out = StringIO()
+        call_command('build_renditions', stdout=out)
+        self.assertIn('Queued 1 rendition jobs', out.getvalue())
+        run_pending()
+        self.assertRenditions(Story.objects.get(pk=story.pk).cover_renditions)
+
+    def test_renditions_are_upright_without_metadata(self):
+        exif = Image.Exif()
+        exif[0x0112] = 6  # Orientation, rotated 90 degrees
+        exif[0x010f] = 'Camera'  # Make
+        original = Image.new('RGB', (400, 200))
+        output = io.BytesIO()
+        original.save(output, 'JPEG', exif=exif.tobytes())
+        rendition = Image.open(io.BytesIO(render(Image.open(output), (160, 160), 'WEBP')))
+        self.assertEqual(rendition.size, (80, 160))
+        self.assertFalse(rendition.info.get('exif'))
+
+
+class QueryBudgetTest(QueryBudgetMixin, APITestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.story, cls.readers = seed_fan_out()
+        cls.chapter = cls.story.chapters.order_by('number')[1]
+        cls.reader = cls.readers[0]
+        cls.reply = cls.chapter.replies.filter(user=cls.reader).first()
+
+    def setUp(self):
+        cache.clear()
+        revocations.load()
+
+    def authenticate(self, user):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {user.get_access_token()}')
+
+    def test_story_create_budget(self):
+        self.authenticate(self.reader)
+        with open('stories/testImage.png', 'rb') as image:
+            cover = SimpleUploadedFile('cover.png', image.read(), 'image/png')
+        data = {'title': 'Lighthouse', 'category': 'quest', 'cover': cover, 'author': self.reader.pk, 'tags': ['']}
+        with self.assertQueryBudget(4) as context:
+            response = self.client.post(reverse('stories:story_create'), data)
+        self.assertEqual(response.status_code, 201)
+        # A single INSERT, the cover is named before the story has an id rather than attached by an UPDATE
+        writes = [query['sql'].split()[0] for query in context.captured_queries if '"stories_story"' in
+                  query['sql'].split(' WHERE ')[0] and not query['sql'].startswith('SELECT')]
+        self.assertEqual(writes, ['INSERT'])
+        story = Story.objects.get(pk=response.data['id'])
+        self.assertRegex(story.cover.name, r'^Story Covers/[0-9a-f]{32}_story_cover\.png$')
+        self.assertEqual(Story.advanced.find('Lighthouse').get().pk, story.pk)
+
+    def test_story_update_budget(self):
+        self.authenticate(self.story.author.user)
+        data = {'title': 'New Title', 'category': 'overcome', 'tags': ['tag1,tag2']}
+        with self.assertQueryBudget(3):
+            response = self.client.put(reverse('stories:story_create', args=[self.story.pk]), data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_story_retrieve_budget(self):
+        self.authenticate(self.reader)
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse('stories:story_create', args=[self.story.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_story_delete_budget(self):
+        self.authenticate(self.story.author.user)
+        with self.assertQueryBudget(11):
+            response = self.client.delete(reverse('stories:story_create', args=[self.story.pk]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_story_overview_budget(self):
+        url = f"{reverse('stories:story_overview', args=[self.story.pk])}?user={self.reader.pk}"
+        with self.assertQueryBudget(3):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_follow_budget(self):
+        self.authenticate(self.reader)
+        data = {'user': self.reader.pk, 'author': self.story.author.pk}
+        with self.assertQueryBudget(6):
+            response = self.client.post(reverse('stories:update_follow'), data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_chapters_overview_budget(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse('stories:chapters_overview', args=[self.story.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_report_budget(self):
+        self.authenticate(self.reader)
+        data = {'story': self.story.pk, 'user': self.reader.pk, 'original': 'https://somesecurelink/'}
+        with self.assertQueryBudget(3):
+            response = self.client.post(reverse('stories:report_story'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_chapter_create_budget(self):
+        self.authenticate(self.story.author.user)
+        data = {'title': 'Chapter', 'story': self.story.pk, 'content': 'Content'}
+        with self.assertQueryBudget(7):
+            response = self.client.post(reverse('stories:chapter_create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_chapter_bulk_create_budget(self):
+        self.authenticate(self.story.author.user)
+        data = {'story': self.story.pk, 'chapters': [{'title': 'Chapter', 'content': 'Content'}] * 50}
+        with self.assertQueryBudget(5):
+            response = self.client.post(reverse('stories:chapter_create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_chapter_update_budget(self):
+        self.authenticate(self.story.author.user)
+        data = {'title': 'Updated Title', 'content': 'Updated Content'}
+        with self.assertQueryBudget(4):
+            response = self.client.put(reverse('stories:chapter_update', args=[self.chapter.pk]), data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_chapter_delete_budget(self):
+        self.authenticate(self.story.author.user)
+        with self.assertQueryBudget(7):
+            response = self.client.delete(reverse('stories:chapter_update', args=[self.chapter.pk]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_chapter_view_budget(self):
+        url = f"{reverse('stories:chapter_view', args=[self.chapter.pk])}?user={self.reader.pk}"
+        with self.assertQueryBudget(4):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+
+    def test_cached_chapter_view_budget(self):
+        url = f"{reverse('stories:chapter_view', args=[self.chapter.pk])}?user={self.reader.pk}"
+        self.client.get(url)
+        with self.assertQueryBudget(1):
+            response = self.client.get(url)
+        self.assertTrue(response.data['loved'])
+
+    def test_update_chapter_view_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse('stories:update_chapter_view', args=[self.chapter.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_update_chapter_love_budget(self):
+        self.authenticate(self.reader)
+        with self.assertQueryBudget(8):
+            response = self.client.post(reverse('stories:update_chapter_love', args=[self.chapter.pk]),
+                                        {'user': self.reader.pk}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_viewer_state_budget(self):
+        chapters = ','.join(str(pk) for pk in self.story.chapters.values_list('pk', flat=True))
+        params = {'user': self.reader.pk, 'authors': self.story.author.pk, 'chapters': chapters}
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse('stories:viewer_state'), params)
+        self.assertEqual(len(response.data['loved']), 10)
+        with self.assertQueryBudget(0):
+            self.client.get(reverse('stories:viewer_state'), params)
+
+    def test_replies_budget(self):
+        with self.assertQueryBudget(2):
+            response = self.client.get(reverse('stories:reply_view', args=[self.chapter.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_reply_create_budget(self):
+        self.authenticate(self.reader)
+        data = {'user': self.reader.pk, 'chapter': self.chapter.pk, 'content': 'Reply'}
+        with self.assertQueryBudget(7):
+            response = self.client.post(reverse('stories:reply_create'), data, format='json')
+        self.assertEqual(response.status_code, 201)
+
+    def test_reply_update_budget(self):
+        self.authenticate(self.reader)
+        with self.assertQueryBudget(3):
+            response = self.client.put(reverse('stories:reply_update', args=[self.reply.pk]), {'content': 'Edit'},
+                                       format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_reply_delete_budget(self):
+        self.authenticate(self.reader)
+        with self.assertQueryBudget(7):
+            response = self.client.delete(reverse('stories:reply_update', args=[self.reply.pk]))
+        self.assertEqual(response.status_code, 204)
+
+    def test_stories_advanced_budget(self):
+        with self.assertQueryBudget(3):
+            response = self.client.get(f"{reverse('stories:stories_advanced')}?search=Story&onF={self.reader.pk}")
+        self.assertEqual(response.status_code, 200)
+
+    def test_stories_advanced_next_page_budget(self):
+        url = f"{reverse('stories:stories_advanced')}?search=Story&onF={self.reader.pk}"
+        self.client.get(url)
+        with self.assertQueryBudget(1):
+            response = self.client.get(f'{url}&page=1')
+        self.assertEqual(response.status_code, 200)
+
+    def test_stories_advanced_cursor_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(f"{reverse('stories:stories_advanced')}?search=Story&cursor=")
+        self.assertEqual(response.status_code, 200)
+
+    def test_replies_cursor_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(f"{reverse('stories:reply_view', args=[self.chapter.pk])}?cursor=")
+        self.assertEqual(response.status_code, 200)
+
+    def test_latest_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse('stories:latest'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_trending_budget(self):
+        call_command('compute_trending', stdout=StringIO())
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse('stories:trending'))
+        self.assertEqual(response.status_code, 200)
+
+    def test_mine_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse('stories:mine', args=[self.story.author.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_following_budget(self):
+        with self.assertQueryBudget(1):
+            response = self.client.get(reverse('stories:following', args=[self.reader.pk]))
+        self.assertEqual(response.status_code, 200)
+
+    def test_save_fetch_budget(self):
+        with self.assertQueryBudget(3):
+            response = self.client.get(reverse('stories:save_fetch', args=[self.story.pk]))
+        self.assertEqual(response.status_code, 200)
@@ -8,6 +8,7 @@ urlpatterns = [
     path('update/<int:pk>', views.StoryCreationView.as_view(), name='story_create'),
     path('overview/<int:pk>', views.story_overview, name='story_overview'),
     path('update_follow', views.update_follow, name='update_follow'),
+    path('state', views.viewer_state, name='viewer_state'),
     path('overview/chapters/<int:pk>', views.ChaptersOverview.as_view(), name='chapters_overview'),
     path('report', views.ReportView.as_view(), name='report_story'),
     path('create/chapter', views.ChapterCreationView.as_view(), name='chapter_create'),
@@ -1,6 +1,11 @@
 from authentication.models import User
 from django.core.files.uploadedfile import SimpleUploadedFile
-from .models import Story, Chapter
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from .models import Story, Chapter, ChapterView
+from contextlib import contextmanager
+from collections import Counter
+import re
 
 
 classic_register_data = {
@@ -49,3 +54,46 @@ def create_test_chapter(story):
         content='Chapter Content'
     )
     return chapter
+
+
+def seed_fan_out(chapters=10, readers=5, stories=3):
+    """Creates a story with many chapters, each loved, viewed and replied to by every reader, readers following
+    its author and a few other stories, so that per-row queries show up as query counts growing with the data"""
+    story = create_test_story(email='author@example.com')
+    readers = [get_auth_user(email=f'reader{i}@example.com') for i in range(readers)]
+    story.author.followers.add(*readers)
+    chapters = Chapter.objects.bulk_create_numbered(story.pk, [Chapter(title=f'Chapter {i}', content='Content')
+                                                               for i in range(chapters)])
+    ChapterView.objects.record_many([(chapter.pk, f'10.0.0.{i}') for chapter in chapters for i in range(len(readers))])
+    for chapter in chapters:
+        chapter.loves.add(*readers)
+        for reader in readers:
+            chapter.replies.create(user=reader, content='Reply')
+    for i in range(stories):
+        other = create_adv_test_story({'title': f'Story {i}', 'category': 'quest', 'tags': ['tag']},
+                                      email=f'writer{i}@example.com')
+        other.author.followers.add(*readers)
+        create_test_chapter(other)
+    return story, readers
+
+
+def fingerprint(sql):
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'\b\d+(\.\d+)?\b', '?', sql)
+    return re.sub(r'\(\?(, \?)*\)', '(...)', sql)
+
+
+class QueryBudgetMixin:
+
+    @contextmanager
+    def assertQueryBudget(self, queries, seconds=0.5):
+        with CaptureQueriesContext(connection) as context:
+            yield context
+        captured = context.captured_queries
+        total_time = sum(float(query['time']) for query in captured)
+        if len(captured) > queries or total_time > seconds:
+            # Repeated fingerprints first, they are the N+1 suspects
+            counts = Counter(fingerprint(query['sql']) for query in captured)
+            report = '\n'.join(f'{count}x {sql}' for sql, count in counts.most_common())
+            self.fail(f'{len(captured)} queries in {total_time:.3f}s, over the budget of {queries} queries in '
+                      f'{seconds}s:\n{report}')
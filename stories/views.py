@@ -1,14 +1,22 @@
 from rest_framework import generics, mixins
-from .serializers import StoryCreateSerializer, StorySerializer, ChapterOverviewSerializer, ReportSerializer, \
-    ChapterCreateSerializer, ChapterSerializer, ReplySerializer, ReplyCreationSerializer, StoryAdvSerializer,\
-    StorySaveSerializer
-from .models import Story, Chapter, Report, Reply
+from .serializers import StoryCreateSerializer, ChapterOverviewSerializer, ReportSerializer, \
+    ChapterCreateSerializer, ReplySerializer, ReplyCreationSerializer, StoryAdvSerializer,\
+    StorySaveSerializer, ChapterBulkSerializer
+from .models import Story, Chapter, Report, Reply, ChapterView, bump_stat
 from rest_framework.decorators import api_view, authentication_classes, permission_classes
 from authentication.models import User
 from rest_framework.response import Response
 from rest_framework import status
 from authentication.utils import validate_auth
-from .pagination import RepliesPaginator, StoriesPaginator
+from .pagination import RepliesPaginator, StoriesPaginator, FollowingPaginator
+from .buffers import view_buffer
+from .state import followed_authors, loved_chapters, forget_follows, forget_loves
+from .caching import cached_response, single_flight, bump
+from .conditions import story_etag, chapter_etag, chapters_etag, chapters_last_modified, story_overview_data, \
+    chapter_view_data
+from django.views.decorators.http import condition
+from django.utils.decorators import method_decorator
+from django.conf import settings
 import socket
 
 
@@ -36,16 +44,16 @@ class StoryCreationView(generics.GenericAPIView, mixins.CreateModelMixin, mixins
         return self.retrieve(request, pk)
 
 
+@condition(etag_func=story_etag)
 @api_view(['GET'])
 @authentication_classes([])
 @permission_classes([])
 def story_overview(request, pk):
     user_pk = request.GET.get('user')
-    story = Story.objects.get(id=pk)
-    serializer = StorySerializer(story)
+    data = story_overview_data(request, pk)
     if user_pk is not None:
-        serializer.data['author']['inFollowers'] = story.author.followers.filter(pk=user_pk).exists()
-    return Response(serializer.data, status=status.HTTP_200_OK)
+        data['author']['inFollowers'] = data['author']['user']['pk'] in followed_authors(user_pk)
+    return Response(data, status=status.HTTP_200_OK)
 
 
 class ChaptersOverview(generics.GenericAPIView, mixins.ListModelMixin):
@@ -54,22 +62,22 @@ class ChaptersOverview(generics.GenericAPIView, mixins.ListModelMixin):
     authentication_classes = []
     permission_classes = []
 
+    @method_decorator(condition(etag_func=chapters_etag, last_modified_func=chapters_last_modified))
     def get(self, request, pk):
         self.queryset = Chapter.objects.filter(story__id=pk)
-        return self.list(request)
+        return Response(cached_response(f'chapters_overview:{pk}', lambda: self.list(request).data, [f'story:{pk}']))
 
 
+@condition(etag_func=chapter_etag)
 @api_view(['GET'])
 @authentication_classes([])
 @permission_classes([])
 def chapter_view(request, pk):
     user_pk = request.GET.get('user')
-    chapter = Chapter.objects.get(id=pk)
-    serializer = ChapterSerializer(chapter)
-    data = serializer.data
+    data = chapter_view_data(request, pk)
     if user_pk is not None:
-        data['loved'] = chapter.loves.filter(pk=user_pk).exists()
-        data['story']['author']['inFollowers'] = chapter.story.author.followers.filter(pk=user_pk).exists()
+        data['loved'] = pk in loved_chapters(user_pk)
+        data['story']['author']['inFollowers'] = data['story']['author']['user']['pk'] in followed_authors(user_pk)
     return Response(data, status=status.HTTP_200_OK)
 
 
@@ -81,8 +89,17 @@ class ChapterCreationView(generics.GenericAPIView, mixins.CreateModelMixin, mixi
     def post(self, request):
         if not validate_auth(request, request.data['story'], 'story'):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
+        if 'chapters' in request.data:
+            return self.bulk_create(request)
         return self.create(request)
 
+    def bulk_create(self, request):
+        serializer = ChapterBulkSerializer(data=request.data['chapters'], many=True)
+        serializer.is_valid(raise_exception=True)
+        chapters = Chapter.objects.bulk_create_numbered(request.data['story'], [Chapter(**chapter) for chapter
+                                                                                in serializer.validated_data])
+        return Response(ChapterOverviewSerializer(chapters, many=True).data, status=status.HTTP_201_CREATED)
+
     def put(self, request, pk):
         if not validate_auth(request, pk, 'chapter'):
             return Response(status=status.HTTP_401_UNAUTHORIZED)
@@ -93,6 +110,11 @@ class ChapterCreationView(generics.GenericAPIView, mixins.CreateModelMixin, mixi
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         return self.destroy(request, pk)
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        Story.advanced.roll_up_stats(Story.objects.filter(pk=instance.story_id))
+        bump(f'chapter:{instance.pk}', f'story:{instance.story_id}')
+
 
 @api_view(['POST'])
 def update_follow(request):
@@ -112,24 +134,42 @@ def update_follow(request):
         author.author.followers.remove(user)
     else:
         author.author.followers.add(user)
+    forget_follows(user_pk)
 
     return Response({'success': True}, status=status.HTTP_200_OK)
 
 
+@api_view(['GET'])
+@authentication_classes([])
+@permission_classes([])
+def viewer_state(request):
+    try:
+        user_pk = int(request.GET['user'])
+        authors = {int(pk) for pk in request.GET.get('authors', '').split(',') if pk}
+        chapters = {int(pk) for pk in request.GET.get('chapters', '').split(',') if pk}
+    except (KeyError, ValueError):
+        return Response(status=status.HTTP_400_BAD_REQUEST)
+
+    return Response({
+        'following': authors and sorted(authors & followed_authors(user_pk)) or [],
+        'loved': chapters and sorted(chapters & loved_chapters(user_pk)) or []
+    }, status=status.HTTP_200_OK)
+
+
 @api_view(['GET'])
 @authentication_classes([])
 @permission_classes([])
 def update_chapter_views(request, pk):
-    chapter = Chapter.objects.get(pk=pk)
     ip_address = request.META.get('HTTP_X_FORWARDED_FOR') or request.META.get('REMOTE_ADDR')
 
-    if ip_address not in chapter.views:
-        try:
-            socket.inet_aton(ip_address)
-            chapter.views.append(ip_address)
-            chapter.save()
-        except socket.error:
-            pass
+    try:
+        socket.inet_aton(ip_address)
+        if settings.BUFFER_CHAPTER_VIEWS:
+            view_buffer.add(pk, ip_address)
+        else:
+            ChapterView.objects.record(pk, ip_address)
+    except socket.error:
+        pass
     return Response({'success': True}, status=status.HTTP_200_OK)
 
 
@@ -148,6 +188,7 @@ def update_chapter_love(request, pk):
         chapter.loves.remove(user)
     else:
         chapter.loves.add(user)
+    forget_loves(user_pk)
 
     return Response({'success': True}, status=status.HTTP_200_OK)
 
@@ -170,13 +211,13 @@ class ReplyView(generics.GenericAPIView, mixins.ListModelMixin):
     permission_classes = []
 
     def get(self, request, pk):
-        self.queryset = Reply.objects.filter(chapter__pk=pk).order_by('-created')
+        self.queryset = Reply.objects.filter(chapter__pk=pk).select_related('user').order_by('-created')
         return self.list(request)
 
 
 class ReplyCreationView(generics.GenericAPIView, mixins.CreateModelMixin, mixins.UpdateModelMixin,
                         mixins.DestroyModelMixin):
-    queryset = Reply.objects.all()
+    queryset = Reply.objects.select_related('chapter')
     serializer_class = ReplyCreationSerializer
 
     def post(self, request):
@@ -194,6 +235,11 @@ class ReplyCreationView(generics.GenericAPIView, mixins.CreateModelMixin, mixins
             return Response(status=status.HTTP_401_UNAUTHORIZED)
         return self.destroy(request, pk)
 
+    def perform_destroy(self, instance):
+        instance.delete()
+        bump_stat(instance.chapter_id, 'reply_count', -1)
+        bump(f'chapter:{instance.chapter_id}', f'story:{instance.chapter.story_id}')
+
 
 class StoriesAdvancedView(generics.GenericAPIView, mixins.ListModelMixin):
     queryset = None
@@ -217,21 +263,25 @@ class StoriesAdvancedView(generics.GenericAPIView, mixins.ListModelMixin):
 
 class LatestStories(generics.GenericAPIView, mixins.ListModelMixin):
     serializer_class = StoryAdvSerializer
-    queryset = Story.advanced.latest(limit=10)
+    queryset = None
     authentication_classes = []
     permission_classes = []
 
+    @single_flight('latest', ['stories'])
     def get(self, request):
+        self.queryset = Story.advanced.latest(limit=10)
         return self.list(request)
 
 
 class TrendingStories(generics.GenericAPIView, mixins.ListModelMixin):
     serializer_class = StoryAdvSerializer
-    queryset = Story.advanced.trending(limit=10)
+    queryset = None
     authentication_classes = []
     permission_classes = []
 
+    @single_flight('trending', ['stories', 'trending'])
     def get(self, request):
+        self.queryset = Story.advanced.trending(limit=10)
         return self.list(request)
 
 
@@ -249,14 +299,18 @@ class MyStories(generics.GenericAPIView, mixins.ListModelMixin):
 class FollowingStories(generics.GenericAPIView, mixins.ListModelMixin):
     serializer_class = StoryAdvSerializer
     queryset = None
+    pagination_class = FollowingPaginator
     authentication_classes = []
     permission_classes = []
 
     def get(self, request, pk):
-        self.queryset = Story.advanced.following(pk, limit=10)
-        if not self.queryset.exists():
+        if self.paginator.cursor_requested(request):
+            self.queryset = Story.advanced.following(pk)
+            return self.list(request)
+        stories = list(Story.advanced.following(pk, limit=10))
+        if not stories:
             return Response({"message": "noFollow"}, status=status.HTTP_204_NO_CONTENT)
-        return self.list(request)
+        return Response(self.get_serializer(stories, many=True).data)
 
 
 class SaveFetchView(generics.GenericAPIView, mixins.RetrieveModelMixin):
@@ -266,5 +320,6 @@ class SaveFetchView(generics.GenericAPIView, mixins.RetrieveModelMixin):
     permission_classes = []
     queryset = Story.objects.all()
 
+    @method_decorator(condition(etag_func=chapters_etag, last_modified_func=chapters_last_modified))
     def get(self, request, pk):
-        return self.retrieve(request, pk)
\ No newline at end of file
+        return Response(cached_response(f'save_fetch:{pk}', lambda: self.retrieve(request, pk).data, [f'story:{pk}']))
\ No newline at end of file